@@ -1,102 +1,1352 @@
 # this file provides functions to parse data from the Google Places API nearby search
-# provides a workaround for the 60 query limit by recursively splitting circles into 4 smaller circles
+# provides a workaround for the 60 query limit by recursively splitting saturated queries into smaller cells that cover them
 
 import requests, json
 import time
+import os
 import csv
 import math
+import asyncio
+import random
+import threading
+import sqlite3
+import hashlib
+import struct
+import itertools
+from array import array
+from collections import namedtuple, deque
+from requests.adapters import HTTPAdapter
 
 
-def query_category(lat,long,radius,category,all_pois,category_count=0):
+PLACES_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+CATEGORIES = {'accounting','airport','amusement_park','aquarium','art_gallery','atm','bakery','bank','bar','beauty_salon','bicycle_store','book_store','bowling_alley','bus_station',
+              'cafe','campground','car_dealer','car_rental','car_repair','car_wash','casino','cemetery','church','city_hall','clothing_store','convenience_store','courthouse','dentist',
+              'department_store','doctor','drugstore','electrician','electronics_store','embassy','fire_station','florist','funeral_home','furniture_store','gas_station','gym','hair_care',
+              'hardware_store','hindu_temple','home_goods_store','hospital','insurance_agency','jewelry_store','laundry','lawyer','library','light_rail_station','liquor_store',
+              'local_government_office','locksmith','lodging','meal_delivery','meal_takeaway','mosque','movie_rental','movie_theater','moving_company','museum','night_club','painter',
+              'park','parking','pet_store','pharmacy','physiotherapist','plumber','police','post_office','primary_school','real_estate_agency','restaurant','roofing_contractor','rv_park',
+              'school','secondary_school','shoe_store','shopping_mall','spa','stadium','storage','store','subway_station','supermarket','synagogue','taxi_stand','tourist_attraction',
+              'train_station','transit_station','travel_agency','university','veterinary_care','zoo',}
+#categories that most POIs of other categories also belong to, crawled last so the density map already knows their dense cells
+BROAD_CATEGORIES = {'store','school','transit_station','lodging','doctor','restaurant'}
+
+
+class ResponseCache:
     """
-    performs a query request from a category with coords lat,long and radius (in meters)
+    persistent sqlite cache of nearby search responses, keyed on the normalized query (location, radius, type, page token)
+    entries older than ttl seconds are ignored, and the least recently used ones are evicted when the cache grows past max_bytes
+    hits and misses count the lookups since the cache was opened
+    the last use of a hit is only written to disk every used_batch hits (and before evicting or closing), not on every hit
+    """
+    def __init__(self,path='places_cache.sqlite',ttl=7*24*3600,max_bytes=512*2**20,used_batch=256):
+        self.path=path
+        self.ttl=ttl
+        self.max_bytes=max_bytes
+        self.used_batch=used_batch
+        self.used={} #key -> time of the hits not written yet
+        self.hits=0
+        self.misses=0
+        self.lock=threading.Lock()
+        self.db=sqlite3.connect(path,check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, size INTEGER, created REAL, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+        self.db.commit()
+        self.size=self.db.execute('SELECT COALESCE(SUM(size),0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def key(params):
+        """
+        normalizes the query parameters (without the api key) into a cache key
+        """
+        lat,long=(float(x) for x in str(params['location']).split(','))
+        return f"{lat:.7f},{long:.7f}|{float(params['radius']):.2f}|{params['type'].lower()}|{params.get('pagetoken','')}"
+
+    def lookup(self,key):
+        row=self.db.execute('SELECT response,created FROM responses WHERE key=?',(key,)).fetchone()
+        if row is None:
+            return None
+        if time.time()-row[1]>self.ttl:
+            self.delete(key)
+            return None
+        return json.loads(row[0])
+
+    def delete(self,key):
+        row=self.db.execute('SELECT size FROM responses WHERE key=?',(key,)).fetchone()
+        if row is not None:
+            self.db.execute('DELETE FROM responses WHERE key=?',(key,))
+            self.db.commit()
+            self.size-=row[0]
+
+    def get(self,params):
+        """
+        returns the cached response for params, or None
+        a first page only counts as cached if all of its following pages are too, since the page tokens it contains can't be fetched again
+        """
+        with self.lock:
+            key=self.key(params)
+            request=self.lookup(key)
+            page=request
+            while page is not None and page.get('next_page_token') and 'pagetoken' not in params:
+                page=self.lookup(self.key(params|{'pagetoken': page['next_page_token']}))
+            if request is None or page is None:
+                self.misses+=1
+                return None
+            self.hits+=1
+            self.used[key]=time.time()
+            if len(self.used)>=self.used_batch:
+                self.write_used()
+                self.db.commit()
+            return request
+
+    def write_used(self):
+        self.db.executemany('UPDATE responses SET used=? WHERE key=?',[(used,key) for key,used in self.used.items()])
+        self.used={}
+
+    def put(self,params,request):
+        """
+        stores a successful response, evicting the least recently used entries if the cache is full
+        """
+        if request.get('status') not in ('OK','ZERO_RESULTS'):
+            return
+        with self.lock:
+            key=self.key(params)
+            text=json.dumps(request)
+            old=self.db.execute('SELECT size FROM responses WHERE key=?',(key,)).fetchone()
+            now=time.time()
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?)',(key,text,len(text),now,now))
+            self.size+=len(text)-(old[0] if old else 0)
+            #the pending hits go in the same commit
+            self.write_used()
+            if self.size>self.max_bytes:
+                #evict down to 90% so that we don't evict again on the next insert
+                for old_key,size in self.db.execute('SELECT key,size FROM responses ORDER BY used').fetchall():
+                    if self.size<=0.9*self.max_bytes:
+                        break
+                    self.db.execute('DELETE FROM responses WHERE key=?',(old_key,))
+                    self.size-=size
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.write_used()
+            self.db.commit()
+            self.db.close()
+
+
+class BudgetExceeded(Exception):
+    """
+    raised by PlacesClient instead of sending a request once its request budget is used up
+    """
+
+
+class PlacesClient:
+    """
+    client for nearby search requests shared by the whole module
+    keeps a pool of keep-alive connections and retries failed requests with exponential backoff and jitter:
+    an INVALID_REQUEST page token (not ready yet) is retried quickly, OVER_QUERY_LIMIT pauses every request for a while
+    counters has the number of requests, retries and failures (requests that still failed after max_retries)
+    cache: optional ResponseCache, queries found in it are answered without sending a request
+    budget: optional maximum number of requests to send (retries included), after which BudgetExceeded is raised
+    waited is the total time spent sleeping for page tokens, backoff and pauses
+    """
+    def __init__(self,api_key=None,url=PLACES_URL,timeout=10,max_retries=5,backoff=1,max_backoff=32,token_delay=0.25,pool_size=32,cache=None,budget=None):
+        self.api_key=api_key
+        self.cache=cache
+        self.budget=budget
+        self.url=url
+        self.timeout=timeout
+        self.max_retries=max_retries
+        self.backoff=backoff
+        self.max_backoff=max_backoff
+        self.token_delay=token_delay
+        self.session=requests.Session()
+        adapter=HTTPAdapter(pool_connections=1,pool_maxsize=pool_size)
+        self.session.mount('https://',adapter)
+        self.session.mount('http://',adapter)
+        self.counters={'requests': 0,'retries': 0,'failures': 0,'over_query_limit': 0,'invalid_request': 0}
+        self.failed=[] #params of requests that failed for good
+        self.paused_until=0
+        self.waited=0
+        self.lock=threading.Lock()
+
+    def count(self,counter):
+        with self.lock:
+            self.counters[counter]+=1
+
+    def sleep(self,seconds):
+        if seconds>0:
+            self.waited+=seconds
+            time.sleep(seconds)
+
+    async def async_sleep(self,seconds):
+        if seconds>0:
+            self.waited+=seconds
+            await asyncio.sleep(seconds)
+
+    def params(self,lat,long,radius,category,page_token=None):
+        """
+        returns the query parameters of a request
+        """
+        params={'location': f'{lat},{long}','radius': radius,'type': category,
+                'key': self.api_key if self.api_key is not None else API_KEY}
+        if page_token:
+            params['pagetoken']=page_token
+        return params
+
+    def send(self,params):
+        """
+        sends a single request (no retries) and returns the json response
+        network errors, http errors and unreadable responses are returned as a response with status 'HTTP_ERROR'
+        """
+        with self.lock:
+            if self.budget is not None and self.counters['requests']>=self.budget:
+                raise BudgetExceeded(f'request budget of {self.budget} used up')
+            self.counters['requests']+=1
+        try:
+            response=self.session.get(self.url,params=params,timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException,ValueError) as error:
+            return {'status': 'HTTP_ERROR','results': [],'error_message': str(error)}
+
+    def retry_delay(self,attempt,status,params):
+        """
+        returns how many seconds to wait before retrying a request that got status, or None if it should not be retried
+        """
+        if attempt>=self.max_retries:
+            return None
+        if status=='INVALID_REQUEST':
+            #a fresh page token is invalid for a couple of seconds, any other invalid request will not get better
+            if 'pagetoken' not in params:
+                return None
+            self.count('invalid_request')
+            return min(self.token_delay*2**attempt,2)*random.uniform(0.75,1.25)
+        if status=='OVER_QUERY_LIMIT':
+            self.count('over_query_limit')
+            delay=min(self.backoff*4*2**attempt,self.max_backoff)*random.uniform(0.5,1)
+            self.paused_until=max(self.paused_until,time.monotonic()+delay)
+            return delay
+        if status in ('HTTP_ERROR','UNKNOWN_ERROR'):
+            return random.uniform(0,min(self.backoff*2**attempt,self.max_backoff))
+        return None #REQUEST_DENIED etc.
+
+    def finish(self,request,params):
+        status=request.get('status')
+        if status!='OK' and status!='ZERO_RESULTS':
+            self.count('failures')
+            self.failed.append({key: value for key,value in params.items() if key!='key'}|{'status': status})
+        elif self.cache is not None:
+            self.cache.put(params,request)
+        return request
+
+    def cached(self,params):
+        if self.cache is None:
+            return None
+        return self.cache.get(params)
+
+    def get(self,lat,long,radius,category,page_token=None,wait=0):
+        """
+        returns the json response of a nearby search request, retrying it while it is worth it
+        wait: seconds to wait before sending the request if it isn't cached (a fresh page token takes a moment to become valid)
+        """
+        params=self.params(lat,long,radius,category,page_token)
+        request=self.cached(params)
+        if request is not None:
+            return request
+        self.sleep(wait)
+        attempt=0
+        while True:
+            self.sleep(self.paused_until-time.monotonic())
+            request=self.send(params)
+            delay=self.retry_delay(attempt,request.get('status'),params)
+            if delay is None:
+                return self.finish(request,params)
+            self.count('retries')
+            attempt+=1
+            self.sleep(delay)
+
+    async def async_get(self,lat,long,radius,category,limiter,page_token=None,wait=0):
+        """
+        async version of get, every attempt is rate limited by limiter and sent without blocking the event loop
+        """
+        params=self.params(lat,long,radius,category,page_token)
+        request=await asyncio.to_thread(self.cached,params)
+        if request is not None:
+            return request
+        await self.async_sleep(wait)
+        attempt=0
+        while True:
+            await self.async_sleep(self.paused_until-time.monotonic())
+            await limiter.acquire()
+            request=await asyncio.to_thread(self.send,params)
+            delay=self.retry_delay(attempt,request.get('status'),params)
+            if delay is None:
+                #finish stores the response in the cache, which writes to disk
+                return await asyncio.to_thread(self.finish,request,params)
+            self.count('retries')
+            attempt+=1
+            await self.async_sleep(delay)
+
+
+default_client=None
+
+
+def get_client():
+    """
+    returns the client shared by the module, created on first use
+    """
+    global default_client
+    if default_client is None:
+        default_client=PlacesClient()
+    return default_client
+
+
+def get_data(result):
+    """
+    takes a result from the results section of an API request and returns a tuple of the fields we want
+    or None if it has no place id or location
+    """
+    location=result.get('geometry',{}).get('location',{})
+    if not result.get('place_id') or location.get('lat') is None or location.get('lng') is None:
+        return None
+    return (result.get('place_id',None),result.get('name',None),location.get('lat',None),location.get('lng',None),
+            tuple(result.get('types',())))
+
+
+#1 degree latitude=111,120 meters, 1 degree longitude=111,319.488*cos(latitude) meters
+def meters_to_degrees(lat,north,east):
+    """
+    returns the (lat,long) offset in degrees of moving north and east meters from latitude lat
+    """
+    return north/111120,east/(111319.488*math.cos(lat*math.pi/180))
+
+
+def distance(lat1,long1,lat2,long2):
+    """
+    approximate distance in meters between two nearby points
+    """
+    north=(lat2-lat1)*111120
+    east=(long2-long1)*111319.488*math.cos((lat1+lat2)/2*math.pi/180)
+    return math.hypot(north,east)
+
+
+# a cell of a tiling: the circle (lat,long,radius) that is queried, and a key locating it in the tiling
+Cell=namedtuple('Cell',['lat','long','radius','key'])
+
+
+def sub_circles(lat,long,radius):
+    """
+    returns the 4 (lat,long,radius) circles of half the radius that a saturated circle is split into
+    """
+    delta_lat,delta_long=meters_to_degrees(lat,radius/math.sqrt(8),radius/math.sqrt(8))
+    return [(lat+delta_lat,long+delta_long,radius/2),(lat+delta_lat,long-delta_long,radius/2),
+            (lat-delta_lat,long+delta_long,radius/2),(lat-delta_lat,long-delta_long,radius/2)]
+
+
+GRID_CELL=1600 #side in meters of the level 0 squares of GridTiling
+
+
+def grid_origin(lat,long):
+    """
+    the origin of the global grid around (lat,long): the center of its 1x1 degree box
+    """
+    return math.floor(lat)+0.5,math.floor(long)+0.5
+
+
+class CircleTiling:
+    """
+    the original tiling: a saturated circle is split into 4 circles of half the radius offset by radius/sqrt(8)
+    (they overlap each other and don't fully cover the parent circle)
+    """
+    name='circles'
+
+    def __init__(self,min_radius=10):
+        self.min_radius=min_radius
+
+    def state(self):
+        return {'min_radius': self.min_radius}
+
+    def root(self,lat,long,radius):
+        return Cell(lat,long,radius,(lat,long,radius))
+
+    def children(self,cell):
+        if cell.radius/2<self.min_radius:
+            return []
+        return [Cell(lat,long,radius,(lat,long,radius)) for lat,long,radius in sub_circles(cell.lat,cell.long,cell.radius)]
+
+
+class QuadTiling:
+    """
+    quadtree tiling with full coverage: the search circle is inscribed in a square, and a saturated cell is split into
+    the 4 quarters of its square, each queried with its circumscribed circle, so the children always cover the parent
+    quarters that don't touch the search circle are dropped
+    key is (root lat, root long, root radius, level, column, row): at level l the square is cut into 2**l x 2**l cells
+    """
+    name='quad'
+
+    def __init__(self,min_radius=10):
+        self.min_radius=min_radius
+
+    def state(self):
+        return {'min_radius': self.min_radius}
+
+    def root(self,lat,long,radius):
+        return Cell(lat,long,radius,(lat,long,radius,0,0,0))
+
+    def children(self,cell):
+        root_lat,root_long,root_radius,level,column,row=cell.key
+        half=root_radius/2**(level+1) #half side of the children squares
+        if half*math.sqrt(2)<self.min_radius:
+            return []
+        children=[]
+        for child_column in (2*column,2*column+1):
+            for child_row in (2*row,2*row+1):
+                #center of the child square in meters east and north of the root center
+                east=-root_radius+(2*child_column+1)*half
+                north=-root_radius+(2*child_row+1)*half
+                #closest point of the square to the root center must be inside the search circle
+                if math.hypot(max(abs(east)-half,0),max(abs(north)-half,0))>root_radius:
+                    continue
+                delta_lat,delta_long=meters_to_degrees(root_lat,north,east)
+                children.append(Cell(root_lat+delta_lat,root_long+delta_long,half*math.sqrt(2),
+                                     (root_lat,root_long,root_radius,level+1,child_column,child_row)))
+        return children
+
+
+class GridTiling:
+    """
+    tiling of search circles on a global grid of squares, so that overlapping circles, and later crawls of overlapping or
+    shifted areas, query the same cells and share cached responses (with QuadTiling only an exact rerun hits the cache)
+    positions are measured in meters from origin, by default the center of the 1x1 degree box of the first circle,
+    so crawls in the same box share one grid; a saturated square is split into quarters, keeping those that touch a circle
+    key is (level, column, row): at level l the squares have side cell_size/2**l (l can be negative)
+    a search circle can also be queried as it is (root, key ()), it is then split into the grid squares of the smallest
+    level whose side is at most its radius (like the first split of QuadTiling, but not centered so usually more squares)
+    """
+    name='grid'
+
+    def __init__(self,circles,cell_size=GRID_CELL,origin=None,min_radius=10):
+        self.circles=[tuple(circle) for circle in circles]
+        self.cell_size=cell_size
+        self.origin=tuple(origin) if origin is not None else grid_origin(*self.circles[0][:2])
+        self.min_radius=min_radius
+
+    def state(self):
+        return {'circles': self.circles,'cell_size': self.cell_size,'origin': self.origin,'min_radius': self.min_radius}
+
+    def meters(self,lat,long):
+        """
+        (east,north) position of (lat,long) in meters from the origin
+        """
+        north=(lat-self.origin[0])*111120
+        east=(long-self.origin[1])*111319.488*math.cos(self.origin[0]*math.pi/180)
+        return east,north
+
+    def point(self,east,north):
+        delta_lat,delta_long=meters_to_degrees(self.origin[0],north,east)
+        return self.origin[0]+delta_lat,self.origin[1]+delta_long
+
+    def cell(self,level,column,row):
+        side=self.cell_size/2**level
+        lat,long=self.point((column+0.5)*side,(row+0.5)*side)
+        #meters east are measured at the origin's latitude, so the corners are measured again where the square is
+        radius=max(distance(lat,long,*self.point(east*side,north*side)) for east in (column,column+1) for north in (row,row+1))
+        return Cell(lat,long,radius,(level,column,row))
+
+    def root(self,lat,long,radius):
+        return Cell(lat,long,radius,())
+
+    def touches(self,level,column,row,circles=None):
+        """
+        True if the square touches one of the circles (the tiling's circles by default)
+        measured in degrees, since meters east from the origin are only right near the origin's latitude
+        """
+        side=self.cell_size/2**level
+        south,west=self.point(column*side,row*side)
+        north,east=self.point((column+1)*side,(row+1)*side)
+        for lat,long,radius in self.circles if circles is None else circles:
+            #the point of the square closest to the center
+            if distance(lat,long,min(max(lat,south),north),min(max(long,west),east))<=radius:
+                return True
+        return False
+
+    def squares(self,level,circles=None):
+        """
+        the cells of the grid squares of level touching at least one circle
+        """
+        side=self.cell_size/2**level
+        squares=set()
+        for lat,long,radius in self.circles if circles is None else circles:
+            #bounding box of the circle, measured east-west at its latitude furthest from the equator
+            delta_lat=radius/111120
+            delta_long=radius/(111319.488*max(math.cos(min(abs(lat)+delta_lat,89.9)*math.pi/180),1e-9))
+            west,south=self.meters(lat-delta_lat,long-delta_long)
+            east,north=self.meters(lat+delta_lat,long+delta_long)
+            for column in range(math.floor(west/side),math.floor(east/side)+1):
+                for row in range(math.floor(south/side),math.floor(north/side)+1):
+                    if self.touches(level,column,row,circles):
+                        squares.add((column,row))
+        return [self.cell(level,column,row) for column,row in sorted(squares)]
+
+    def roots(self,level=0):
+        return self.squares(level)
+
+    def children(self,cell):
+        if cell.radius/2<self.min_radius:
+            return []
+        if not cell.key:
+            level=math.ceil(math.log2(self.cell_size/cell.radius))
+            return self.squares(level,[(cell.lat,cell.long,cell.radius)])
+        level,column,row=cell.key
+        return [self.cell(level+1,child_column,child_row) for child_column in (2*column,2*column+1) for child_row in (2*row,2*row+1)
+                if self.touches(level+1,child_column,child_row)]
+
+
+TILINGS={'quad': QuadTiling,'circles': CircleTiling,'grid': GridTiling}
+
+
+class DensityMap:
+    """
+    what a crawl has learned so far, shared by all categories:
+    every POI found is counted in small grid buckets per type (a POI found for 'restaurant' usually also has 'food', 'bar', ...)
+    so that a later category can tell a cell will be saturated without querying it, and go straight to its children
+    also counts queries, saturated and skipped cells, and results vs unique results to measure the redundancy of the tiling
+    seen: PlaceIndex of the place ids already counted in buckets and of the (category,place id) found, in memory by default
+    only the counts are checkpointed, seen is rebuilt from the places written (so after a resume, results found again for
+    a category before the checkpoint count as unique again)
+    """
+    def __init__(self,bucket=0.0002,limit=60,seen=None):
+        self.bucket=bucket #bucket side in degrees, about 20m
+        self.limit=limit
+        self.buckets={} #type -> {(row,column): number of POIs}
+        self.seen=seen if seen is not None else PlaceIndex()
+        self.unique=0 #number of different (category,place id) found
+        self.queries=0
+        self.results=0
+        self.saturated=[]
+        self.skipped=0
+
+    def queried(self,cell,category,count):
+        """
+        records that querying cell for category returned count results in total
+        """
+        self.queries+=1
+        if count>=self.limit:
+            self.saturated.append((category,cell.lat,cell.long,cell.radius))
+
+    def found(self,category,results):
+        """
+        records a page of results of a query for category
+        """
+        self.results+=len(results)
+        for result in results:
+            poi=get_data(result)
+            if poi is None:
+                continue
+            place_id=poi[0]
+            if self.seen.add(category+'/'+place_id):
+                self.unique+=1
+            if not self.seen.add(place_id):
+                continue
+            bucket=(math.floor(poi[2]/self.bucket),math.floor(poi[3]/self.bucket))
+            for poi_type in poi[4]:
+                type_buckets=self.buckets.setdefault(poi_type,{})
+                type_buckets[bucket]=type_buckets.get(bucket,0)+1
+
+    def known(self,cell,category):
+        """
+        lower bound on the number of POIs of category inside cell: only buckets entirely inside the circle are counted
+        """
+        type_buckets=self.buckets.get(category,{})
+        #only the buckets in the circle's bounding box (measured east-west at its latitude furthest from the equator)
+        delta_lat=cell.radius/111120
+        delta_long=cell.radius/(111319.488*max(math.cos(min(abs(cell.lat)+delta_lat,89.9)*math.pi/180),1e-9))
+        rows=range(math.floor((cell.lat-delta_lat)/self.bucket),math.floor((cell.lat+delta_lat)/self.bucket)+1)
+        columns=range(math.floor((cell.long-delta_long)/self.bucket),math.floor((cell.long+delta_long)/self.bucket)+1)
+        if len(rows)*len(columns)<len(type_buckets):
+            candidates=((row,column) for row in rows for column in columns if (row,column) in type_buckets)
+        else:
+            candidates=(bucket for bucket in type_buckets if bucket[0] in rows and bucket[1] in columns)
+        count=0
+        for row,column in candidates:
+            bucket_count=type_buckets[(row,column)]
+            corners=[(row+i)*self.bucket for i in (0,1)],[(column+j)*self.bucket for j in (0,1)]
+            if all(distance(cell.lat,cell.long,lat,long)<=cell.radius for lat in corners[0] for long in corners[1]):
+                count+=bucket_count
+        return count
+
+    def dense(self,cell,category):
+        """
+        True if querying cell for category is known to return the maximum number of results
+        """
+        return self.known(cell,category)>=self.limit
+
+    def redundancy(self):
+        """
+        fraction of the results returned by the API that were duplicates within their category
+        """
+        return 1-self.unique/self.results if self.results else 0
+
+    def to_dict(self):
+        self.seen.commit()
+        return {'bucket': self.bucket,'limit': self.limit,'seen_path': self.seen.path,'bloom': self.seen.bloom_size,'unique': self.unique,
+                'buckets': [[poi_type,row,column,count] for poi_type,type_buckets in self.buckets.items() for (row,column),count in type_buckets.items()],
+                'queries': self.queries,'results': self.results,'saturated': self.saturated,'skipped': self.skipped}
+
+    @classmethod
+    def from_dict(cls,state,place_ids=()):
+        """
+        the density map saved by to_dict, with seen rebuilt from place_ids (the places written before the checkpoint)
+        """
+        seen=PlaceIndex(state['seen_path'],state['bloom'])
+        seen.clear()
+        for place_id in place_ids:
+            seen.add(place_id)
+        density=cls(state['bucket'],state['limit'],seen)
+        density.unique=state['unique']
+        for poi_type,row,column,count in state['buckets']:
+            density.buckets.setdefault(poi_type,{})[(row,column)]=count
+        density.queries=state['queries']
+        density.results=state['results']
+        density.saturated=[tuple(saturated) for saturated in state['saturated']]
+        density.skipped=state['skipped']
+        return density
+
+    def report(self):
+        return (f'{self.queries} queries, {len(self.saturated)} saturated cells, {self.skipped} cells split without querying, '
+                f'{self.results} results, {self.unique} unique, redundant ratio {self.redundancy():.2f}')
+
+    def close(self):
+        self.seen.close()
+
+
+class TokenBucket:
+    """
+    token-bucket rate limiter for the async crawl: on average rate requests per second, in bursts of at most capacity
+    """
+    def __init__(self,rate,capacity=1):
+        self.rate=rate
+        self.capacity=capacity
+        self.tokens=capacity
+        self.updated=time.monotonic()
+        self.waited=0
+        self.lock=asyncio.Lock()
+
+    async def acquire(self):
+        """
+        waits until a token is available and takes it
+        """
+        async with self.lock:
+            while True:
+                now=time.monotonic()
+                self.tokens=min(self.capacity,self.tokens+(now-self.updated)*self.rate)
+                self.updated=now
+                if self.tokens>=1:
+                    self.tokens-=1
+                    return
+                self.waited+=(1-self.tokens)/self.rate
+                await asyncio.sleep((1-self.tokens)/self.rate)
+
+
+# a pending unit of work of a crawl: query cell for category, starting at page_token (None for the first page)
+# count is the number of results the earlier pages of the same query returned, restarted is True once it was queried again
+# from the first page because a page token expired
+WorkItem=namedtuple('WorkItem',['category','cell','page_token','count','restarted'],defaults=(False,))
+
+
+class Crawl:
+    """
+    a crawl with an explicit frontier of pending work items instead of a recursion stack
+    every item fetches one page, and queues either the next page of its query or, when the query is saturated, the children cells
+    both go to the front of the frontier, so a category is finished before the next one starts and the density map can learn from it
+    output: where the POIs go, a PoiWriter streaming them to files or a set
+    if checkpoint is a path, the frontier, the output (the POIs if it is a set, else how far the files are written) and the
+    density map are saved there every checkpoint_every seconds and when the crawl stops, so that Crawl.load can continue it
+    items whose request failed for good (quota exhausted, network down) are kept in failed and queued again when the crawl is loaded
+    config: what the crawl covers (json data, e.g. the search circles), saved with the checkpoint so Crawl.load can tell it apart
+    from a crawl of somewhere else
     """
-    count=0
-    api_key = API_KEY
-    url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-    initial_url = url + '?location=' + str(lat)+'%2C'+str(long) + '&radius=' + str(radius) + '&type=' + category + '&key=' + api_key
-    
-    #first request
-    request=requests.get(initial_url).json()
-    #looping through the pages:
-    while request.get('next_page_token',False):
+    def __init__(self,client=None,tiling=None,density=None,checkpoint=None,checkpoint_every=30,output=None,config=None):
+        self.client=client or get_client()
+        self.tiling=tiling or QuadTiling()
+        self.density=density if density is not None else DensityMap()
+        self.checkpoint=checkpoint
+        self.checkpoint_every=checkpoint_every
+        self.config=config
+        self.output=output if output is not None else set()
+        self.category_counts={}
+        self.frontier=deque()
+        self.in_progress={}
+        self.failed=[]
+        self.pages=0
+        self.stopped=False #set when the client's request budget runs out
+        self.saved=time.monotonic()
+
+    def start(self,lat,long,radius,categories):
+        """
+        queues the search circle (lat,long,radius) for every category
+        """
+        self.start_cells([self.tiling.root(lat,long,radius)],categories)
+
+    def start_cells(self,cells,categories):
+        """
+        queues every cell for every category, a category at a time
+        """
+        for category in categories:
+            self.category_counts.setdefault(category,0)
+            self.frontier.extend(WorkItem(category,cell,None,0) for cell in cells)
+
+    def expand(self,item):
+        """
+        if item is the first page of a cell the density map knows is saturated, queues its children and returns True
+        """
+        if item.page_token is not None or not self.density.dense(item.cell,item.category):
+            return False
+        children=self.tiling.children(item.cell)
+        if not children:
+            return False
+        self.density.skipped+=1
+        self.frontier.extendleft(WorkItem(item.category,child,None,0) for child in reversed(children))
+        return True
+
+    def handle(self,item,request):
+        """
+        records the page request got for item, and queues what comes next
+        """
+        category,cell=item.category,item.cell
         status=request['status']
         if status!='OK' and status!='ZERO_RESULTS':
-            print('error')
-        results=request['results']
+            print('error',status,category,cell.lat,cell.long,cell.radius)
+            if item.page_token is not None and status=='INVALID_REQUEST' and not item.restarted:
+                #the page token expired (e.g. resumed from an old checkpoint): query the cell again from the first page, once,
+                #and forget the results of the earlier pages, they come again
+                self.category_counts[category]-=item.count
+                self.density.results-=item.count
+                self.frontier.appendleft(WorkItem(category,cell,None,0,True))
+            else:
+                self.failed.append(item)
+            return
+        self.pages+=1
+        results=request.get('results',[])
         for result in results:
-            all_pois.add(get_data(result))
-            count+=1
-        time.sleep(2)
+            poi=get_data(result)
+            if poi is not None:
+                self.output.add(poi)
+        self.category_counts[category]=self.category_counts.get(category,0)+len(results)
+        self.density.found(category,results)
+        count=item.count+len(results)
         next_page=request.get('next_page_token',False)
-        request = requests.get(initial_url + '&pagetoken=' + next_page).json()
-    #last page
-    status=request['status']
-    if status!='OK' and status!='ZERO_RESULTS':
-        print('error')
-    results=request['results']
-    for result in results:
-        all_pois.add(get_data(result))
-        count+=1
-
-    #add to total
-    category_count+=count
-
-    #if reached limit (60 queries), recursively query 4 smaller circles
-    if count==60:
-        delta_lat=radius/(math.sqrt(8)*111120)
-        delta_long=radius/(math.sqrt(8)*111319.488*math.cos(lat*math.pi/180))
-        #1 degree latitude=111,120 meters, 1 degree longitude=111,319.488*cos(latitude) meters
-        all_pois,category_count=query_category(lat+delta_lat,long+delta_long,radius/2,category,all_pois,category_count)
-        all_pois,category_count=query_category(lat+delta_lat,long-delta_long,radius/2,category,all_pois,category_count)
-        all_pois,category_count=query_category(lat-delta_lat,long+delta_long,radius/2,category,all_pois,category_count)
-        all_pois,category_count=query_category(lat-delta_lat,long-delta_long,radius/2,category,all_pois,category_count)
-
-    return all_pois,category_count
+        if next_page:
+            self.frontier.appendleft(WorkItem(category,cell,next_page,count,item.restarted))
+            return
+        self.density.queried(cell,category,count)
+        #if reached limit (60 queries), query the smaller cells
+        if count==60:
+            self.frontier.extendleft(WorkItem(category,child,None,0) for child in reversed(self.tiling.children(cell)))
 
+    def fetch(self,item):
+        cell=item.cell
+        if item.page_token is None:
+            return self.client.get(cell.lat,cell.long,cell.radius,item.category)
+        #the page token takes a moment to become valid, the client retries it until it is
+        return self.client.get(cell.lat,cell.long,cell.radius,item.category,item.page_token,wait=self.client.token_delay)
 
-def get_data(result):
+    async def async_fetch(self,item,limiter):
+        cell=item.cell
+        if item.page_token is None:
+            return await self.client.async_get(cell.lat,cell.long,cell.radius,item.category,limiter)
+        return await self.client.async_get(cell.lat,cell.long,cell.radius,item.category,limiter,item.page_token,wait=self.client.token_delay)
+
+    def run(self):
+        """
+        processes the frontier one item at a time until it is empty
+        """
+        try:
+            while self.frontier:
+                item=self.frontier.popleft()
+                self.in_progress[id(item)]=item
+                try:
+                    if not self.expand(item):
+                        self.handle(item,self.fetch(item))
+                except BudgetExceeded:
+                    del self.in_progress[id(item)]
+                    self.frontier.appendleft(item)
+                    self.stopped=True
+                    return
+                #not in a finally: if anything else interrupts the item, the checkpoint keeps it in progress to be redone
+                del self.in_progress[id(item)]
+                self.maybe_save()
+        finally:
+            self.save()
+
+    async def run_async(self,concurrency=8,qps=10):
+        """
+        processes the frontier with concurrency items in flight and at most qps requests per second
+        """
+        limiter=self.limiter=TokenBucket(qps,capacity=max(1,int(qps)))
+        changed=asyncio.Condition()
+
+        async def worker():
+            while True:
+                async with changed:
+                    #an empty frontier is only final once no other worker can add to it
+                    await changed.wait_for(lambda: self.frontier or not self.in_progress or self.stopped)
+                    if not self.frontier or self.stopped:
+                        return
+                    item=self.frontier.popleft()
+                    self.in_progress[id(item)]=item
+                try:
+                    if not self.expand(item):
+                        self.handle(item,await self.async_fetch(item,limiter))
+                except BudgetExceeded:
+                    self.frontier.appendleft(item)
+                    self.stopped=True
+                except Exception as error:
+                    print('error',item.category,item.cell,error)
+                    self.failed.append(item)
+                #no await since handle, so a checkpoint can't see the item both handled and in progress
+                del self.in_progress[id(item)]
+                async with changed:
+                    changed.notify_all()
+                self.maybe_save()
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        finally:
+            self.save()
+
+    def maybe_save(self):
+        if self.checkpoint and time.monotonic()-self.saved>=self.checkpoint_every:
+            self.save()
+
+    def save(self):
+        """
+        writes the checkpoint (items in flight are saved as pending, their results are deduplicated when they are redone)
+        """
+        if not self.checkpoint:
+            return
+        state={'config': self.config,'tiling': {'name': self.tiling.name}|self.tiling.state(),'pages': self.pages,
+               'frontier': list(self.in_progress.values())+list(self.frontier),'failed': self.failed,
+               'category_counts': self.category_counts,'density': self.density.to_dict(),
+               'output': self.output.flush() if isinstance(self.output,PoiWriter) else list(self.output)}
+        #write to a temporary file first so a crash while saving can't corrupt the last checkpoint
+        with open(self.checkpoint+'.tmp','w') as file:
+            json.dump(state,file)
+        os.replace(self.checkpoint+'.tmp',self.checkpoint)
+        self.saved=time.monotonic()
+
+    @classmethod
+    def load(cls,checkpoint,client=None,checkpoint_every=30,config=None):
+        """
+        returns the crawl saved in checkpoint, with the items that had failed queued again
+        if config is given, raises ValueError when the checkpoint was saved by a crawl with another config (before touching its files)
+        """
+        with open(checkpoint) as file:
+            state=json.load(file)
+        #compared as json, where tuples are lists
+        if config is not None and state.get('config')!=json.loads(json.dumps(config)):
+            raise ValueError(f"{checkpoint} is the checkpoint of another crawl ({state.get('config')}), remove it to start this one")
+        tiling_state=dict(state['tiling'])
+        tiling=TILINGS[tiling_state.pop('name')](**tiling_state)
+        if isinstance(state['output'],dict):
+            output=PoiWriter.resume(state['output'])
+        else:
+            output={tuple(poi[:4])+(tuple(poi[4]),) for poi in state['output']}
+        place_ids=output.place_ids() if isinstance(output,PoiWriter) else (poi[0] for poi in output)
+        density=DensityMap.from_dict(state['density'],place_ids)
+        crawl=cls(client,tiling,density,checkpoint,checkpoint_every,output,state.get('config'))
+        crawl.category_counts=state['category_counts']
+        crawl.pages=state['pages']
+        for category,cell,*rest in state['frontier']:
+            crawl.frontier.append(WorkItem(category,Cell(*cell[:3],tuple(cell[3])),*rest))
+        #a failed item gets one more restart in every run
+        for category,cell,page_token,count,*restarted in state['failed']:
+            crawl.frontier.append(WorkItem(category,Cell(*cell[:3],tuple(cell[3])),page_token,count))
+        return crawl
+
+    def done(self):
+        """
+        removes the checkpoint once nothing is left to do, returns False if some items failed or the budget ran out before the
+        frontier was empty (the checkpoint is kept to continue)
+        """
+        if self.failed or self.frontier:
+            return False
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        return True
+
+
+def query_category(lat,long,radius,category,all_pois,category_count=0,client=None,tiling=None,density=None):
     """
-    takes a result from the results section of an API request and returns a tuple of the fields we want
+    performs a query request from a category with coords lat,long and radius (in meters)
+    if the query is saturated (60 results), queries the smaller cells of tiling that cover it, and so on
+    density: optional DensityMap shared between categories, cells it knows are saturated are split without being queried
+    """
+    crawl=Crawl(client,tiling,density,output=all_pois)
+    crawl.start(lat,long,radius,[category])
+    crawl.run()
+    return all_pois,category_count+crawl.category_counts[category]
+
+
+async def async_crawl(lat,long,radius,categories,concurrency=8,qps=10,client=None,tiling=None,density=None):
+    """
+    crawls every category around (lat,long) with at most concurrency requests in flight and qps requests per second
+    returns the set of POIs and a dict of category -> number of results
     """
-    place_id=result.get('place_id',None),
-    name=result.get('name',None),
-    lat=result.get('geometry',None).get('location',None).get('lat',None),
-    long=result.get('geometry',None).get('location',None).get('lng',None),
-    types=tuple(result.get('types',None))
-    return place_id+name+lat+long+(types,)
+    crawl=Crawl(client,tiling,density)
+    crawl.start(lat,long,radius,categories)
+    await crawl.run_async(concurrency,qps)
+    return crawl.output,crawl.category_counts
 
 
-def nearby_search(place,lat,long,radius=1138):
+def place_hash(place_id):
+    """
+    64 bit hash of a place id (signed, so it fits an sqlite integer), 8 bytes instead of a ~30 character string
+    """
+    return int.from_bytes(hashlib.blake2b(place_id.encode(),digest_size=8).digest(),'little',signed=True)
+
+
+class BloomFilter:
+    """
+    probabilistic set of 64 bit hashes: never misses an added hash, and wrongly reports about 1% of others for 10 bits per item
+    """
+    def __init__(self,expected,bits_per_item=10,hashes=7):
+        self.size=max(64,expected*bits_per_item)
+        self.hashes=hashes
+        self.bits=bytearray(self.size//8+1)
+
+    def positions(self,value):
+        #double hashing with the two 32 bit halves of the hash
+        low,high=value&0xffffffff,(value>>32)&0xffffffff
+        return [(low+i*high)%self.size for i in range(self.hashes)]
+
+    def add(self,value):
+        for position in self.positions(value):
+            self.bits[position>>3]|=1<<(position&7)
+
+    def __contains__(self,value):
+        return all(self.bits[position>>3]&(1<<(position&7)) for position in self.positions(value))
+
+
+class PlaceIndex:
+    """
+    a set of place ids (the ones written so far for PoiWriter), as 64 bit hashes
+    kept in memory, or in an sqlite file at path to bound memory for very large crawls (committed at every checkpoint)
+    bloom: expected number of places, to put a bloom filter in front of the index so most new places skip the lookup
+    """
+    def __init__(self,path=None,bloom=0):
+        self.path=path
+        self.bloom_size=bloom
+        self.bloom=BloomFilter(bloom) if bloom else None
+        if path is None:
+            self.hashes=set()
+        else:
+            self.db=sqlite3.connect(path)
+            self.db.execute('CREATE TABLE IF NOT EXISTS places (hash INTEGER PRIMARY KEY)')
+
+    def add(self,place_id):
+        """
+        adds place_id, returns False if it was already there
+        """
+        value=place_hash(place_id)
+        if self.bloom is not None:
+            if value not in self.bloom:
+                self.bloom.add(value)
+                self.insert(value)
+                return True
+        if self.path is None:
+            if value in self.hashes:
+                return False
+            self.hashes.add(value)
+            return True
+        return self.db.execute('INSERT OR IGNORE INTO places VALUES (?)',(value,)).rowcount==1
+
+    def insert(self,value):
+        if self.path is None:
+            self.hashes.add(value)
+        else:
+            self.db.execute('INSERT OR IGNORE INTO places VALUES (?)',(value,))
+
+    def clear(self):
+        if self.bloom is not None:
+            self.bloom=BloomFilter(self.bloom_size)
+        if self.path is None:
+            self.hashes=set()
+        else:
+            self.db.execute('DELETE FROM places')
+
+    def commit(self):
+        if self.path is not None:
+            self.db.commit()
+
+    def close(self):
+        if self.path is not None:
+            self.db.commit()
+            self.db.close()
+
+
+# packed columnar format: the header, then batches of rows, each batch being
+# the number of rows (uint32), the lat and lng columns (float64 each) and the id, name and types columns
+# (types joined by commas), each string column as its total size (uint32), the end offset of every string (uint32) and the utf-8 bytes
+PACKED_HEADER=b'POIPACK1'
+
+
+def pack_batch(pois):
+    """
+    returns the bytes of a batch of POI tuples in the packed format
+    """
+    columns=list(zip(*pois))
+    data=[struct.pack('<I',len(pois)),array('d',columns[2]).tobytes(),array('d',columns[3]).tobytes()]
+    for strings in (columns[0],columns[1],[','.join(types) for types in columns[4]]):
+        encoded=[(string or '').encode() for string in strings]
+        ends=array('I',itertools.accumulate(len(string) for string in encoded))
+        data+=[struct.pack('<I',ends[-1]),ends.tobytes(),b''.join(encoded)]
+    return b''.join(data)
+
+
+def read_packed(filename):
+    """
+    yields the POI tuples (id,name,lat,lng,types) of a packed file
+    """
+    with open(filename,'rb') as file:
+        data=file.read()
+    if data[:len(PACKED_HEADER)]!=PACKED_HEADER:
+        raise ValueError(f'{filename} is not a packed POI file')
+    position=len(PACKED_HEADER)
+    while position<len(data):
+        rows,=struct.unpack_from('<I',data,position)
+        position+=4
+        lats=array('d',data[position:position+8*rows])
+        lngs=array('d',data[position+8*rows:position+16*rows])
+        position+=16*rows
+        columns=[]
+        for _ in range(3):
+            size,=struct.unpack_from('<I',data,position)
+            ends=array('I',data[position+4:position+4+4*rows])
+            blob=data[position+4+4*rows:position+4+4*rows+size]
+            position+=4+4*rows+size
+            columns.append([blob[start:end].decode() for start,end in zip([0]+list(ends[:-1]),ends)])
+        for place_id,name,lat,lng,types in zip(columns[0],columns[1],lats,lngs,columns[2]):
+            yield place_id,name,lat,lng,tuple(types.split(',')) if types else ()
+
+
+class PoiWriter:
+    """
+    writes POIs to a csv file as pages arrive, skipping place ids it has already written, so the crawl doesn't keep them in memory
+    columnar: also write a compact columnar copy, 'packed' (a .poi file, see read_packed) or 'parquet' (a directory of
+    parquet files, one per checkpoint, needs pyarrow)
+    index: PlaceIndex used to skip duplicates, defaults to an in-memory one
+    """
+    def __init__(self,filename,columnar=None,index=None,batch=1024,append=False):
+        if columnar not in (None,'packed','parquet'):
+            raise ValueError(f'unknown columnar format {columnar}')
+        self.filename=filename
+        self.columnar=columnar
+        self.index=index if index is not None else PlaceIndex()
+        self.batch=batch
+        self.pending=[]
+        self.rows=0
+        self.parts=0
+        self.parquet=None
+        base=filename[:-4] if filename.endswith('.csv') else filename
+        self.packed_filename=base+'.poi'
+        self.parquet_dir=base+'.parquet'
+        self.file=open(filename,'a' if append else 'w',newline='')
+        self.writer=csv.writer(self.file)
+        if not append:
+            self.writer.writerow(['id','name','lat','lng','types'])
+        if columnar=='packed':
+            self.packed=open(self.packed_filename,'ab' if append else 'wb')
+            if not append:
+                self.packed.write(PACKED_HEADER)
+        elif columnar=='parquet':
+            try:
+                import pyarrow, pyarrow.parquet
+            except ImportError:
+                raise ImportError("parquet output needs pyarrow (pip install pyarrow), or use columnar='packed'")
+            self.pyarrow=pyarrow
+            self.schema=pyarrow.schema([('id',pyarrow.string()),('name',pyarrow.string()),('lat',pyarrow.float64()),
+                                        ('lng',pyarrow.float64()),('types',pyarrow.list_(pyarrow.string()))])
+            os.makedirs(self.parquet_dir,exist_ok=True)
+
+    def add(self,poi):
+        """
+        writes poi unless its place id was already written
+        """
+        if not self.index.add(poi[0]):
+            return
+        self.writer.writerow(poi)
+        self.rows+=1
+        if self.columnar:
+            self.pending.append(poi)
+            if len(self.pending)>=self.batch:
+                self.write_batch()
+
+    def write_batch(self):
+        if not self.pending:
+            return
+        if self.columnar=='packed':
+            self.packed.write(pack_batch(self.pending))
+        else:
+            if self.parquet is None:
+                self.parquet=self.pyarrow.parquet.ParquetWriter(os.path.join(self.parquet_dir,f'part-{self.parts:05}.parquet'),self.schema)
+            columns=list(zip(*self.pending))
+            self.parquet.write_table(self.pyarrow.table([list(columns[0]),list(columns[1]),list(columns[2]),list(columns[3]),
+                                                         [list(types) for types in columns[4]]],schema=self.schema))
+        self.pending=[]
+
+    def flush(self):
+        """
+        makes everything added so far durable and returns the state needed to resume writing after it
+        """
+        if self.columnar:
+            self.write_batch()
+        if self.parquet is not None:
+            #a parquet file can't be appended to, so every checkpoint closes the current part
+            self.parquet.close()
+            self.parquet=None
+            self.parts+=1
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.columnar=='packed':
+            self.packed.flush()
+            os.fsync(self.packed.fileno())
+        self.index.commit()
+        return {'filename': self.filename,'columnar': self.columnar,'index_path': self.index.path,'bloom': self.index.bloom_size,
+                'rows': self.rows,'parts': self.parts,'csv_size': self.file.tell(),
+                'packed_size': self.packed.tell() if self.columnar=='packed' else 0}
+
+    def place_ids(self):
+        """
+        yields the place ids written to the csv file
+        """
+        self.file.flush()
+        with open(self.filename,newline='') as file:
+            reader=csv.reader(file)
+            next(reader)
+            for row in reader:
+                yield row[0]
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        if self.columnar=='packed':
+            self.packed.close()
+        self.index.close()
+
+    @classmethod
+    def resume(cls,state):
+        """
+        reopens the files of a flushed writer, dropping whatever was written after the flush, and rebuilds its index
+        """
+        with open(state['filename'],'r+') as file:
+            file.truncate(state['csv_size'])
+        base=state['filename'][:-4] if state['filename'].endswith('.csv') else state['filename']
+        if state['columnar']=='packed':
+            with open(base+'.poi','r+b') as file:
+                file.truncate(state['packed_size'])
+        elif state['columnar']=='parquet':
+            for part in os.listdir(base+'.parquet'):
+                if int(part[5:10])>=state['parts']:
+                    os.remove(os.path.join(base+'.parquet',part))
+        index=PlaceIndex(state['index_path'],state['bloom'])
+        index.clear()
+        writer=cls(state['filename'],state['columnar'],index,append=True)
+        for place_id in writer.place_ids():
+            index.add(place_id)
+        writer.rows=state['rows']
+        writer.parts=state['parts']
+        return writer
+
+
+def nearby_search(place,lat,long,radius=1138,concurrency=None,qps=10,client=None,tiling='quad',checkpoint=True,checkpoint_every=30,
+                  columnar=None,index_path=None,bloom=0):
     """
     input: place (str name of place we want to search around), coordinates lat and long, radius (number in meters, default circumcircle of 1x1 mile square is 1138m)
+    concurrency: if given, crawl categories and sub-circles asynchronously with that many requests in flight, at most qps requests per second
+    client: PlacesClient to send the requests with, defaults to the shared client of the module
+    tiling: how saturated queries are split, a name in TILINGS or a tiling object; 'quad' (the default) and the original 'circles'
+    split the search circle relative to its center, so only an exact rerun hits the cache, 'grid' splits it on the global grid
+    so that crawls of overlapping areas share cached responses, for about 10-20% more requests (its squares can't be centered)
+    checkpoint: file the crawl is saved to every checkpoint_every seconds (True for {place}_{radius}.checkpoint.json, False for none)
+    if the file exists the crawl continues from it (ValueError if it was saved by a crawl of another circle, tiling or columnar),
+    and it is removed once the crawl has finished
+    POIs are written to {place}_{radius}.csv as they are found, once per place id
+    columnar: also write them in a compact columnar format, 'packed' or 'parquet' (see PoiWriter)
+    index_path, bloom: keep the place ids written in an sqlite file instead of memory / behind a bloom filter sized for bloom places
+    (the density map keeps the places and (category,place id) pairs it has counted in index_path+'.density', behind a bloom
+    filter twice that size)
     """
-    categories={'accounting','airport','amusement_park','aquarium','art_gallery','atm','bakery','bank','bar','beauty_salon','bicycle_store','book_store','bowling_alley','bus_station',
-                'cafe','campground','car_dealer','car_rental','car_repair','car_wash','casino','cemetery','church','city_hall','clothing_store','convenience_store','courthouse','dentist',
-                'department_store','doctor','drugstore','electrician','electronics_store','embassy','fire_station','florist','funeral_home','furniture_store','gas_station','gym','hair_care',
-                'hardware_store','hindu_temple','home_goods_store','hospital','insurance_agency','jewelry_store','laundry','lawyer','library','light_rail_station','liquor_store',
-                'local_government_office','locksmith','lodging','meal_delivery','meal_takeaway','mosque','movie_rental','movie_theater','moving_company','museum','night_club','painter',
-                'park','parking','pet_store','pharmacy','physiotherapist','plumber','police','post_office','primary_school','real_estate_agency','restaurant','roofing_contractor','rv_park',
-                'school','secondary_school','shoe_store','shopping_mall','spa','stadium','storage','store','subway_station','supermarket','synagogue','taxi_stand','tourist_attraction',
-                'train_station','transit_station','travel_agency','university','veterinary_care','zoo',}
-    all_pois=set()
-    
-    for category in categories:
-        category_count=query_category(lat,long,radius,category,all_pois)[1]
+    client=client or get_client()
+    config={'sites': [[lat,long,radius]],'tiling': tiling if isinstance(tiling,str) else tiling.name,'columnar': columnar}
+    if checkpoint is True:
+        checkpoint=f'{place}_{radius}.checkpoint.json'
+    if checkpoint and os.path.exists(checkpoint):
+        crawl=Crawl.load(checkpoint,client,checkpoint_every,config)
+        print(f'resuming from {checkpoint}: {len(crawl.frontier)} work items left, {crawl.output.rows} points so far')
+    else:
+        if tiling=='grid':
+            tiling=GridTiling([(lat,long,radius)])
+        elif isinstance(tiling,str):
+            tiling=TILINGS[tiling]()
+        output=PoiWriter(f'{place}_{radius}.csv',columnar,PlaceIndex(index_path,bloom))
+        density=DensityMap(seen=PlaceIndex(index_path and index_path+'.density',bloom and 2*bloom))
+        crawl=Crawl(client,tiling,density,checkpoint,checkpoint_every,output,config)
+        crawl.start(lat,long,radius,sorted(CATEGORIES,key=lambda category: (category in BROAD_CATEGORIES,category)))
+    try:
+        if concurrency:
+            asyncio.run(crawl.run_async(concurrency,qps))
+        else:
+            crawl.run()
+    finally:
+        crawl.output.close()
+        crawl.density.close()
+
+    for category,category_count in crawl.category_counts.items():
         print(f'{category_count} points in {category} category')
-    
-    #save as csv file
-    labels=['id','name','lat','lng','types']
-    data=[poi for poi in all_pois]
-    with open(f'{place}_{radius}.csv','w') as file:
-        writer = csv.writer(file)
-        writer.writerow(labels)
-        for poi_data in data:
-            writer.writerow(poi_data)
+    print(crawl.density.report())
+    print(f"{client.counters['requests']} requests, {client.counters['retries']} retries, {client.counters['failures']} failures")
+    for failed in client.failed:
+        print('failed',failed)
+    if client.cache is not None:
+        print(f'{client.cache.hits} cache hits, {client.cache.misses} cache misses')
+    print(f'{crawl.output.rows} points saved to {crawl.output.filename}')
+    if not crawl.done():
+        print(f'{len(crawl.failed)} work items failed and {len(crawl.frontier)} are left'
+              +(f', run again to continue from {checkpoint}' if checkpoint else ''))
+
+
+def plan_batch(sites,level=None):
+    """
+    sites: list of (place,lat,long) or (place,lat,long,radius) (radius defaults to 1138m like nearby_search)
+    returns the GridTiling covering every site and its root cells, so that overlapping sites share cells
+    level: grid level of the root squares, defaults to the largest squares whose circumscribed circle is at most the largest site radius
+    (large roots are cheap: most categories fit in one page, and the dense ones are split anyway)
+    """
+    circles=[(site[1],site[2],site[3] if len(site)>3 else 1138) for site in sites]
+    if level is None:
+        level=math.ceil(math.log2(GRID_CELL/(max(radius for lat,long,radius in circles)*math.sqrt(2))))
+    tiling=GridTiling(circles)
+    return tiling,tiling.roots(level)
+
+
+def estimate_requests(tiling,cells,categories,prior=None):
+    """
+    estimates the number of requests a crawl of cells for categories will send
+    prior: optional poi_index.PoiIndex of an earlier crawl of the area, used to predict how many results each cell returns
+    (and so how many pages and which cells are saturated); without it every query is assumed to fit in one page
+    """
+    if prior is None:
+        return len(cells)*len(categories)
+    total=0
+    for category in categories:
+        pending=list(cells)
+        while pending:
+            cell=pending.pop()
+            found=min(len(prior.radius(cell.lat,cell.long,cell.radius,category)),60)
+            total+=max(1,math.ceil(found/20))
+            if found==60:
+                pending.extend(tiling.children(cell))
+    return total
+
+
+def split_sites(filename,sites):
+    """
+    writes the POIs of the batch csv filename that are inside each site's circle to {place}_{radius}.csv
+    returns a dict of place -> number of POIs
+    """
+    writers={}
+    counts={}
+    files=[]
+    for site in sites:
+        place,radius=site[0],site[3] if len(site)>3 else 1138
+        file=open(f'{place}_{radius}.csv','w',newline='')
+        files.append(file)
+        writers[place]=(csv.writer(file),site[1],site[2],radius)
+        writers[place][0].writerow(['id','name','lat','lng','types'])
+        counts[place]=0
+    with open(filename,newline='') as file:
+        reader=csv.reader(file)
+        next(reader)
+        for row in reader:
+            for place,(writer,lat,long,radius) in writers.items():
+                if distance(lat,long,float(row[2]),float(row[3]))<=radius:
+                    writer.writerow(row)
+                    counts[place]+=1
+    for file in files:
+        file.close()
+    return counts
+
+
+def batch_search(name,sites,concurrency=8,qps=10,budget=None,client=None,level=None,prior=None,dry_run=False,
+                 checkpoint=True,checkpoint_every=30,columnar=None,index_path=None,bloom=0):
+    """
+    crawls several sites at once: their circles are merged on one grid so that no region is queried twice for a category,
+    results are deduplicated into {name}.csv and then split out into one {place}_{radius}.csv per site
+    sites: list of (place,lat,long) or (place,lat,long,radius), level: see plan_batch
+    budget: maximum number of requests for the whole batch (the crawl stops there and a rerun continues from the checkpoint)
+    prior, dry_run: see estimate_requests, with dry_run only the estimate is printed and returned
+    the other arguments are as in nearby_search; a report of the crawl is saved to {name}_report.json and returned
+    (its waiting_seconds_total adds up the time every concurrent request spent on the rate limit, page tokens and backoff)
+    """
+    client=client or get_client()
+    categories=sorted(CATEGORIES,key=lambda category: (category in BROAD_CATEGORIES,category))
+    config={'sites': [[site[1],site[2],site[3] if len(site)>3 else 1138] for site in sites],'tiling': 'grid','level': level,
+            'columnar': columnar}
+    if checkpoint is True:
+        checkpoint=f'{name}.checkpoint.json'
+    if checkpoint and os.path.exists(checkpoint):
+        crawl=Crawl.load(checkpoint,client,checkpoint_every,config)
+        print(f'resuming from {checkpoint}: {len(crawl.frontier)} work items left, {crawl.output.rows} points so far')
+        estimate=None
+    else:
+        tiling,cells=plan_batch(sites,level)
+        estimate=estimate_requests(tiling,cells,categories,prior)
+        print(f'{len(sites)} sites merged into {len(cells)} cells, about {estimate} requests'+(' at least' if prior is None else ''))
+        if budget is not None and estimate>budget:
+            print(f'the budget of {budget} requests is probably not enough, the crawl will stop there')
+        if dry_run:
+            return {'sites': len(sites),'cells': len(cells),'estimated_requests': estimate}
+        output=PoiWriter(f'{name}.csv',columnar,PlaceIndex(index_path,bloom))
+        density=DensityMap(seen=PlaceIndex(index_path and index_path+'.density',bloom and 2*bloom))
+        crawl=Crawl(client,tiling,density,checkpoint,checkpoint_every,output,config)
+        crawl.start_cells(cells,categories)
+
+    start=time.monotonic()
+    counters_before,waited_before=dict(client.counters),client.waited
+    #the budget is for this batch only, the client (shared by default) gets its own back afterwards
+    client_budget=client.budget
+    if budget is not None:
+        client.budget=client.counters['requests']+budget
+    try:
+        asyncio.run(crawl.run_async(concurrency,qps))
+    finally:
+        client.budget=client_budget
+        crawl.output.close()
+        crawl.density.close()
+
+    counters={counter: client.counters[counter]-counters_before[counter] for counter in client.counters}
+    report={'sites': len(sites),'estimated_requests': estimate,'requests': counters['requests'],
+            'retries': counters['retries'],'failures': counters['failures'],'pages': crawl.pages,
+            'queries': crawl.density.queries,'saturated_cells': len(crawl.density.saturated),'skipped_cells': crawl.density.skipped,
+            'redundant_ratio': crawl.density.redundancy(),'points': crawl.output.rows,
+            'waiting_seconds_total': client.waited-waited_before+crawl.limiter.waited,'seconds': time.monotonic()-start,
+            'budget_exhausted': crawl.stopped,'work_items_left': len(crawl.frontier),'failed_work_items': len(crawl.failed),
+            'cache_hits': client.cache.hits if client.cache is not None else 0,
+            'cache_misses': client.cache.misses if client.cache is not None else 0}
+    report['site_points']=split_sites(f'{name}.csv',sites)
+    with open(f'{name}_report.json','w') as file:
+        json.dump(report,file,indent=1)
+    print(json.dumps(report,indent=1))
+    if not crawl.done():
+        print(f'{len(crawl.failed)} work items failed and {len(crawl.frontier)} are left'
+              +(f', run again to continue from {checkpoint}' if checkpoint else ''))
+    return report
 
 
 ##nearby_search('central_square',42.365128734069586,-71.10254858759215,285)
 ##nearby_search('lexington_green',42.44965384516684,-71.23077273099918)
 ##nearby_search('downtown_concord',42.45985044479248, -71.35018790206628)
-
-
+##batch_search('boston_area',[('central_square',42.365128734069586,-71.10254858759215,285),
+##                            ('lexington_green',42.44965384516684,-71.23077273099918),
+##                            ('downtown_concord',42.45985044479248, -71.35018790206628)],budget=20000)
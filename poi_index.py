@@ -0,0 +1,276 @@
+# this file provides a local spatial index over the POIs collected by nearby_search,
+# to answer radius and k-nearest queries (optionally of one type) without calling the API again
+# the index is a grid of cells sorted by cell plus an inverted index per type, saved in one file that is loaded with mmap
+# the cell size follows the density of the points, so that a dense area doesn't put thousands of points in a cell
+
+import ast
+import bisect
+import csv
+from collections import Counter
+import heapq
+import math
+import mmap
+import struct
+from array import array
+
+
+HEADER=b'POIIDX01'
+# after the header: cell size (float64), number of points, cells, types, covered circles (uint32 each), then the sections
+# cell keys (int64, sorted), cell starts (uint32, one more than cells), lat and lng (float64), covered circles (3 float64 each),
+# type starts (uint32, one more than types), type points (uint32, sorted point numbers of each type),
+# and the string columns type names, ids, names and point types (joined by commas), each as end offsets (uint32) then utf-8 bytes
+LAYOUT='<dIIII'
+EARTH_RADIUS=6371008.8
+
+
+def haversine(lat1,long1,lat2,long2):
+    """
+    distance in meters between two points on the earth
+    """
+    p=math.pi/180
+    h=math.sin((lat2-lat1)*p/2)**2+math.cos(lat1*p)*math.cos(lat2*p)*math.sin((long2-long1)*p/2)**2
+    return 2*EARTH_RADIUS*math.asin(min(1,math.sqrt(h)))
+
+
+def cell_key(row,column):
+    """
+    a single integer for a grid cell, ordered by row then column
+    """
+    return (row<<32)+(column+2**31)
+
+
+def load_pois(filename):
+    """
+    returns the POI tuples (id,name,lat,lng,types) of a nearby_search csv file or packed .poi file
+    """
+    if filename.endswith('.poi'):
+        from nearby_search import read_packed
+        return list(read_packed(filename))
+    pois=[]
+    with open(filename,newline='') as file:
+        reader=csv.reader(file)
+        next(reader)
+        for place_id,name,lat,lng,types in reader:
+            pois.append((place_id,name,float(lat),float(lng),ast.literal_eval(types)))
+    return pois
+
+
+def pack_strings(strings):
+    encoded=[string.encode() for string in strings]
+    ends=array('I')
+    end=0
+    for string in encoded:
+        end+=len(string)
+        ends.append(end)
+    return ends.tobytes()+b''.join(encoded)
+
+
+def cell_size(pois,per_cell=32):
+    """
+    side in degrees of grid cells holding about per_cell points around an average point
+    starts from the size that gives per_cell points per cell if they were spread evenly over their bounding box,
+    and halves it while the cells are fuller than that where the points are (the dense areas decide)
+    """
+    if not pois:
+        return 0.005
+    lats=[poi[2] for poi in pois]
+    lngs=[poi[3] for poi in pois]
+    area=max(max(lats)-min(lats),1e-4)*max(max(lngs)-min(lngs),1e-4)
+    cell=math.sqrt(area*per_cell/len(pois))
+    while cell>1e-5:
+        counts=Counter((math.floor(lat/cell),math.floor(lng/cell)) for lat,lng in zip(lats,lngs))
+        #points in the cell of an average point
+        if sum(count*count for count in counts.values())/len(pois)<=per_cell:
+            break
+        cell/=2
+    return cell
+
+
+def build_index(pois,filename,cell=None,coverage=()):
+    """
+    writes the index of pois (tuples (id,name,lat,lng,types)) to filename
+    cell: side of the grid cells in degrees (0.005 is about 550m north-south), by default from the density of pois (see cell_size)
+    coverage: (lat,lng,radius) circles that were crawled, used by PoiIndex.covers
+    """
+    if cell is None:
+        cell=cell_size(pois)
+    keyed=sorted(((cell_key(math.floor(poi[2]/cell),math.floor(poi[3]/cell)),poi) for poi in pois),key=lambda item: item[0])
+    keys=array('q')
+    starts=array('I')
+    for number,(key,poi) in enumerate(keyed):
+        if not keys or keys[-1]!=key:
+            keys.append(key)
+            starts.append(number)
+    starts.append(len(keyed))
+    pois=[poi for key,poi in keyed]
+
+    type_points={}
+    for number,poi in enumerate(pois):
+        for poi_type in poi[4]:
+            type_points.setdefault(poi_type,array('I')).append(number)
+    type_names=sorted(type_points)
+    type_starts=array('I',[0])
+    for poi_type in type_names:
+        type_starts.append(type_starts[-1]+len(type_points[poi_type]))
+
+    with open(filename,'wb') as file:
+        file.write(HEADER)
+        file.write(struct.pack(LAYOUT,cell,len(pois),len(keys),len(type_names),len(coverage)))
+        file.write(keys.tobytes())
+        file.write(starts.tobytes())
+        file.write(array('d',[poi[2] for poi in pois]).tobytes())
+        file.write(array('d',[poi[3] for poi in pois]).tobytes())
+        file.write(array('d',[value for circle in coverage for value in circle]).tobytes())
+        file.write(type_starts.tobytes())
+        for poi_type in type_names:
+            file.write(type_points[poi_type].tobytes())
+        file.write(pack_strings(type_names))
+        file.write(pack_strings([poi[0] or '' for poi in pois]))
+        file.write(pack_strings([poi[1] or '' for poi in pois]))
+        file.write(pack_strings([','.join(poi[4]) for poi in pois]))
+
+
+class PoiIndex:
+    """
+    an index written by build_index, mapped into memory so opening it doesn't read the file
+    radius and nearest return lists of (distance in meters, (id,name,lat,lng,types)), closest first
+    """
+    def __init__(self,filename):
+        self.file=open(filename,'rb')
+        self.map=mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        view=memoryview(self.map)
+        if bytes(view[:len(HEADER)])!=HEADER:
+            raise ValueError(f'{filename} is not a POI index')
+        position=len(HEADER)
+        self.cell,self.size,cells,types,circles=struct.unpack_from(LAYOUT,self.map,position)
+        position+=struct.calcsize(LAYOUT)
+
+        def section(length,code):
+            nonlocal position
+            width=struct.calcsize(code)
+            part=view[position:position+length*width].cast(code)
+            position+=length*width
+            return part
+
+        self.keys=section(cells,'q')
+        self.starts=section(cells+1,'I')
+        self.lats=section(self.size,'d')
+        self.lngs=section(self.size,'d')
+        coverage=section(3*circles,'d')
+        self.coverage=[tuple(coverage[3*i:3*i+3]) for i in range(circles)]
+        type_starts=section(types+1,'I')
+        type_points=section(type_starts[-1],'I')
+
+        def strings(length):
+            nonlocal position
+            ends=section(length,'I')
+            blob=view[position:position+(ends[-1] if length else 0)]
+            position+=len(blob)
+            return ends,blob
+
+        names=strings(types)
+        self.types={self.string(names,i): type_points[type_starts[i]:type_starts[i+1]] for i in range(types)}
+        self.ids=strings(self.size)
+        self.names=strings(self.size)
+        self.point_types=strings(self.size)
+
+    @staticmethod
+    def string(strings,i):
+        ends,blob=strings
+        return bytes(blob[ends[i-1] if i else 0:ends[i]]).decode()
+
+    def poi(self,i):
+        """
+        returns the POI tuple of point number i
+        """
+        types=self.string(self.point_types,i)
+        return (self.string(self.ids,i),self.string(self.names,i),self.lats[i],self.lngs[i],tuple(types.split(',')) if types else ())
+
+    def has_type(self,i,poi_type):
+        points=self.types.get(poi_type,())
+        j=bisect.bisect_left(points,i)
+        return j<len(points) and points[j]==i
+
+    def cell_points(self,row,first_column,last_column,points=None):
+        """
+        yields the point numbers in the cells of row between the two columns
+        points: sorted point numbers (of a type) to keep, the points of a cell are a range so they are a slice of points
+        """
+        i=bisect.bisect_left(self.keys,cell_key(row,first_column))
+        last=cell_key(row,last_column)
+        while i<len(self.keys) and self.keys[i]<=last:
+            if points is None:
+                yield from range(self.starts[i],self.starts[i+1])
+            else:
+                yield from points[bisect.bisect_left(points,self.starts[i]):bisect.bisect_left(points,self.starts[i+1])]
+            i+=1
+
+    def candidates(self,lat,lng,radius,poi_type=None):
+        """
+        point numbers that may be within radius meters of (lat,lng), and of poi_type if given
+        """
+        #degrees spanned by radius meters, a little more to be safe, east-west at the latitude furthest from the equator
+        meters=EARTH_RADIUS*math.pi/180/1.0001
+        delta_lat=radius/meters
+        delta_lng=radius/(meters*max(math.cos(min(abs(lat)+delta_lat,89.9)*math.pi/180),1e-9))
+        rows=range(math.floor((lat-delta_lat)/self.cell),math.floor((lat+delta_lat)/self.cell)+1)
+        first_column,last_column=math.floor((lng-delta_lng)/self.cell),math.floor((lng+delta_lng)/self.cell)
+        if poi_type is not None:
+            points=self.types.get(poi_type,())
+            #a rare type is faster to scan directly than the cells
+            if len(points)<=len(rows)*(last_column-first_column+1):
+                return [i for i in points if abs(self.lats[i]-lat)<=delta_lat and abs(self.lngs[i]-lng)<=delta_lng]
+            return [i for row in rows for i in self.cell_points(row,first_column,last_column,points)]
+        return [i for row in rows for i in self.cell_points(row,first_column,last_column)]
+
+    def radius(self,lat,lng,radius,poi_type=None):
+        """
+        POIs within radius meters of (lat,lng), of poi_type if given
+        """
+        found=[]
+        for i in self.candidates(lat,lng,radius,poi_type):
+            distance=haversine(lat,lng,self.lats[i],self.lngs[i])
+            if distance<=radius:
+                found.append((distance,i))
+        found.sort()
+        return [(distance,self.poi(i)) for distance,i in found]
+
+    def nearest(self,lat,lng,k=1,poi_type=None,max_radius=None):
+        """
+        the k POIs closest to (lat,lng), of poi_type if given, and no further than max_radius meters if given
+        searches circles of doubling radius until k points are found in one
+        """
+        if poi_type is not None and poi_type not in self.types:
+            return []
+        total=len(self.types[poi_type]) if poi_type is not None else self.size
+        radius=self.cell*111120/2
+        while True:
+            if max_radius is not None:
+                radius=min(radius,max_radius)
+            found=[]
+            for i in self.candidates(lat,lng,radius,poi_type):
+                distance=haversine(lat,lng,self.lats[i],self.lngs[i])
+                if distance<=radius:
+                    found.append((distance,i))
+            #every point within radius was seen, so once there are k of them the k closest are right
+            if len(found)>=min(k,total) or radius==max_radius or radius>=math.pi*EARTH_RADIUS:
+                return [(distance,self.poi(i)) for distance,i in heapq.nsmallest(k,found)]
+            radius*=2
+
+    def covers(self,lat,lng,radius=0):
+        """
+        True if the circle of radius meters around (lat,lng) is inside an area that was crawled
+        """
+        return any(haversine(lat,lng,circle_lat,circle_lng)+radius<=circle_radius for circle_lat,circle_lng,circle_radius in self.coverage)
+
+    def close(self):
+        #drop the views on the map before closing it
+        self.keys=self.starts=self.lats=self.lngs=self.types=self.ids=self.names=self.point_types=None
+        self.map.close()
+        self.file.close()
+
+
+##build_index(load_pois('central_square_285.csv'),'central_square.idx',coverage=[(42.365128734069586,-71.10254858759215,285)])
+##index=PoiIndex('central_square.idx')
+##if index.covers(42.3651,-71.1025,200): print(index.radius(42.3651,-71.1025,200,'cafe'))
+##print(index.nearest(42.3651,-71.1025,5,'restaurant'))
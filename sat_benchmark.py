@@ -0,0 +1,291 @@
+# this file benchmarks the solver in sat_solver on reproducible generated instances:
+# sudoku boards, random 3-SAT at the phase transition, pigeonhole (UNSAT) and DIMACS files
+# usage: python sat_benchmark.py --output bench.json --baseline old_bench.json
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+
+from sat_solver import satisfying_assignment, sudoku_board_to_sat_formula
+
+
+#solvers to benchmark, name -> function(formula,stats) returning an assignment dict or None
+#any alternative engine added to sat_solver should be registered here (or passed with --engine module:function)
+ENGINES={
+    'satisfying_assignment': satisfying_assignment,
+}
+
+#the formula of an n x n board has about 2*n**4 clauses, 16x16 takes over a minute to solve and 25x25 far longer,
+#so they are left out by default (add them with --sudoku-sizes 4 9 16 25 and a --timeout)
+SUDOKU_SIZES=(4,9)
+SUDOKU_GIVENS=(0.35,0.25,0.2) #fraction of cells that are pre-filled, sparse enough that the solver has to make decisions
+TIMEOUT=60 #seconds per run
+RANDOM_SAT_SIZES=(10,20,30,40,50) #number of variables
+RANDOM_SAT_RATIO=4.26 #clauses/variables, the hardest region for random 3-SAT
+RANDOM_SAT_SEEDS=3 #instances per size
+PIGEONHOLES=(3,4,5,6) #number of holes, with one more pigeon than holes
+#runs are timed out in a forked child process, where fork isn't available (Windows) they run in this process without a timeout
+CAN_FORK='fork' in multiprocessing.get_all_start_methods()
+
+
+def sudoku_solution(n,rng):
+    """
+    returns a random complete n-by-n sudoku board (n must be a perfect square)
+    built from the standard pattern and shuffled with rng
+    """
+    sub_n=int(n**0.5)
+    def shuffled(seq):
+        seq=list(seq)
+        rng.shuffle(seq)
+        return seq
+    rows=[band*sub_n+row for band in shuffled(range(sub_n)) for row in shuffled(range(sub_n))]
+    cols=[stack*sub_n+col for stack in shuffled(range(sub_n)) for col in shuffled(range(sub_n))]
+    values=shuffled(range(1,n+1))
+    #pattern for a valid board: value at (r,c) is (sub_n*(r%sub_n)+r//sub_n+c)%n
+    return [[values[(sub_n*(r%sub_n)+r//sub_n+c)%n] for c in cols] for r in rows]
+
+
+def sudoku_puzzle(n,givens,seed):
+    """
+    returns an n-by-n sudoku board with round(givens*n*n) pre-filled cells (0 means empty)
+    the same (n,givens,seed) always gives the same board
+    """
+    rng=random.Random(f'sudoku-{n}-{givens}-{seed}')
+    board=sudoku_solution(n,rng)
+    cells=[(row,col) for row in range(n) for col in range(n)]
+    rng.shuffle(cells)
+    for row,col in cells[round(givens*n*n):]:
+        board[row][col]=0
+    return board
+
+
+def random_3sat(num_vars,ratio,seed):
+    """
+    returns a uniform random 3-SAT formula with round(ratio*num_vars) clauses over variables 1..num_vars
+    """
+    rng=random.Random(f'3sat-{num_vars}-{ratio}-{seed}')
+    formula=[]
+    for _ in range(round(ratio*num_vars)):
+        variables=rng.sample(range(1,num_vars+1),3)
+        formula.append([(var,rng.random()<0.5) for var in variables])
+    return formula
+
+
+def pigeonhole(holes):
+    """
+    returns the (unsatisfiable) formula saying holes+1 pigeons fit into holes holes with at most one per hole
+    variable (p,h) means pigeon p is in hole h
+    """
+    pigeons=holes+1
+    formula=[]
+    for p in range(pigeons):
+        formula.append([((p,h),True) for h in range(holes)]) #every pigeon is in some hole
+    for h in range(holes):
+        for p1 in range(pigeons):
+            for p2 in range(p1+1,pigeons):
+                formula.append([((p1,h),False),((p2,h),False)]) #no two pigeons share a hole
+    return formula
+
+
+def read_dimacs(path):
+    """
+    reads a DIMACS cnf file and returns the formula, with variables named by their integer
+    """
+    formula=[]
+    clause=[]
+    with open(path) as file:
+        for line in file:
+            line=line.strip()
+            if not line or line[0] in 'cp%':
+                continue
+            for token in line.split():
+                literal=int(token)
+                if literal==0:
+                    formula.append(clause)
+                    clause=[]
+                else:
+                    clause.append((abs(literal),literal>0))
+    if clause:
+        formula.append(clause)
+    return formula
+
+
+def check_model(formula,assignment):
+    """
+    returns True if assignment satisfies every clause of formula
+    (variables left out of the assignment satisfy nothing)
+    """
+    return all(any(assignment.get(var)==value for var,value in clause) for clause in formula)
+
+
+def generate_instances(sudoku_sizes=SUDOKU_SIZES,sat_sizes=RANDOM_SAT_SIZES,pigeonholes=PIGEONHOLES,dimacs_dir=None,seed=0):
+    """
+    returns a list of instance dicts with keys name, family, formula and expected (True/False/None if unknown)
+    """
+    instances=[]
+    for n in sudoku_sizes:
+        for givens in SUDOKU_GIVENS:
+            board=sudoku_puzzle(n,givens,seed)
+            instances.append({'name': f'sudoku-{n}x{n}-givens{givens}-s{seed}','family': 'sudoku',
+                              'formula': sudoku_board_to_sat_formula(board),'expected': True})
+    for num_vars in sat_sizes:
+        for i in range(RANDOM_SAT_SEEDS):
+            instances.append({'name': f'3sat-v{num_vars}-r{RANDOM_SAT_RATIO}-s{seed+i}','family': '3sat',
+                              'formula': random_3sat(num_vars,RANDOM_SAT_RATIO,seed+i),'expected': None})
+    for holes in pigeonholes:
+        instances.append({'name': f'pigeonhole-{holes+1}-{holes}','family': 'pigeonhole',
+                          'formula': pigeonhole(holes),'expected': False})
+    if dimacs_dir:
+        for filename in sorted(os.listdir(dimacs_dir)):
+            if filename.endswith(('.cnf','.dimacs')):
+                instances.append({'name': filename,'family': 'dimacs',
+                                  'formula': read_dimacs(os.path.join(dimacs_dir,filename)),'expected': None})
+    return instances
+
+
+def solve(engine,formula):
+    """
+    solves formula with engine and returns (assignment,stats,time)
+    """
+    stats={'decisions': 0,'conflicts': 0}
+    start=time.perf_counter()
+    assignment=engine(formula,stats)
+    return assignment,stats,time.perf_counter()-start
+
+
+def solve_in_child(engine,formula,connection):
+    """
+    runs in a child process: sends the result of solve back through connection
+    """
+    connection.send(solve(engine,formula))
+
+
+def solve_with_timeout(engine,formula,timeout):
+    """
+    solves formula with engine in a child process (forked, so the formula isn't copied)
+    returns (assignment,stats,time), or None if it didn't finish within timeout seconds
+    without fork (see CAN_FORK) it is solved in this process and never times out
+    """
+    if not CAN_FORK:
+        return solve(engine,formula)
+    context=multiprocessing.get_context('fork')
+    receiver,sender=context.Pipe(duplex=False)
+    process=context.Process(target=solve_in_child,args=(engine,formula,sender))
+    process.start()
+    sender.close()
+    finished=receiver.poll(timeout)
+    result=receiver.recv() if finished else None
+    process.terminate()
+    process.join()
+    return result
+
+
+def run_instance(engine,instance,repeat=1,timeout=TIMEOUT):
+    """
+    solves instance with engine repeat times and returns a result dict (time is the best of the runs)
+    a run that takes longer than timeout seconds stops the instance and is recorded with status 'timeout'
+    """
+    formula=instance['formula']
+    size={'instance': instance['name'],'family': instance['family'],
+          'variables': len({var for clause in formula for var,_ in clause}),'clauses': len(formula)}
+    best=None
+    for _ in range(repeat):
+        result=solve_with_timeout(engine,formula,timeout)
+        if result is None:
+            return size|{'status': 'timeout','satisfiable': None,'correct': None,'time': None,'decisions': None,'conflicts': None}
+        assignment,stats,elapsed=result
+        if best is None or elapsed<best:
+            best=elapsed
+    satisfiable=assignment is not None
+    if satisfiable:
+        correct=check_model(formula,assignment)
+    else:
+        correct=instance['expected'] is not True
+    if instance['expected'] is not None and instance['expected']!=satisfiable:
+        correct=False
+    return size|{'status': 'ok' if correct else 'wrong','satisfiable': satisfiable,'correct': correct,'time': best,
+                 'decisions': stats['decisions'],'conflicts': stats['conflicts']}
+
+
+def compare(results,baseline,seed=None):
+    """
+    prints the time ratio of every (engine,instance) in results against the same run in baseline
+    seed: the seed of results, a baseline generated with another seed has other instances and is only warned about
+    """
+    if seed is not None and baseline.get('seed',seed)!=seed:
+        print(f"warning: the baseline was generated with seed {baseline['seed']} and these results with seed {seed},"
+              f" only instances read from files can be compared")
+    old={(r['engine'],r['instance']): r for r in baseline['results']}
+    for result in results:
+        before=old.get((result['engine'],result['instance']))
+        if before is None:
+            continue
+        if result['time'] is None or before['time'] is None:
+            print(f"{result['engine']:<24} {result['instance']:<36} {before.get('status','ok')} -> {result['status']}")
+            continue
+        ratio=result['time']/before['time'] if before['time'] else float('inf')
+        print(f"{result['engine']:<24} {result['instance']:<36} {before['time']:9.4f}s -> {result['time']:9.4f}s  x{ratio:.2f}"
+              f"  decisions {before['decisions']} -> {result['decisions']}")
+
+
+def load_engine(spec):
+    """
+    loads an engine given as 'module:function'
+    """
+    module_name,function_name=spec.split(':')
+    module=importlib.import_module(module_name)
+    return getattr(module,function_name)
+
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='benchmark SAT engines on generated instances')
+    parser.add_argument('--sudoku-sizes',type=int,nargs='*',default=list(SUDOKU_SIZES))
+    parser.add_argument('--sat-sizes',type=int,nargs='*',default=list(RANDOM_SAT_SIZES))
+    parser.add_argument('--pigeonholes',type=int,nargs='*',default=list(PIGEONHOLES))
+    parser.add_argument('--dimacs-dir',help='directory of .cnf files to include')
+    parser.add_argument('--engine',action='append',default=[],help='extra engine as module:function')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--repeat',type=int,default=1)
+    parser.add_argument('--timeout',type=float,default=TIMEOUT,help='seconds before a run is recorded as a timeout')
+    parser.add_argument('--output',default='bench_output.json')
+    parser.add_argument('--baseline',help='previous output to compare against')
+    args=parser.parse_args(argv)
+
+    if not CAN_FORK:
+        print('fork is not available, runs are not timed out')
+    engines=dict(ENGINES)
+    for spec in args.engine:
+        engines[spec]=load_engine(spec)
+    instances=generate_instances(args.sudoku_sizes,args.sat_sizes,args.pigeonholes,args.dimacs_dir,args.seed)
+
+    results=[]
+    for instance in instances:
+        for name,engine in engines.items():
+            result=run_instance(engine,instance,args.repeat,args.timeout)
+            result['engine']=name
+            results.append(result)
+            if result['status']=='timeout':
+                print(f"{name:<24} {result['instance']:<36} timeout after {args.timeout}s")
+            else:
+                print(f"{name:<24} {result['instance']:<36} {result['time']:9.4f}s  decisions {result['decisions']:<8}"
+                      f" conflicts {result['conflicts']:<8} {'ok' if result['correct'] else 'WRONG'}")
+
+    report={'python': platform.python_version(),'seed': args.seed,'repeat': args.repeat,'timeout': args.timeout,
+            'recursion_limit': sys.getrecursionlimit(),'results': results}
+    with open(args.output,'w') as file:
+        json.dump(report,file,indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results,json.load(file),args.seed)
+    return 0 if all(result['correct'] is not False for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
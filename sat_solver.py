@@ -28,10 +28,11 @@ def reduce_formula(formula,c):
     return reduced
 
 
-def satisfying_assignment(formula):
+def satisfying_assignment(formula,stats=None):
     """
     Find a satisfying assignment for a given CNF formula.
     Returns that assignment if one exists, or None otherwise.
+    if stats (a dict) is given, the number of 'decisions' and 'conflicts' are added to it
 
     >>> satisfying_assignment([])
     {}
@@ -59,13 +60,17 @@ def satisfying_assignment(formula):
 
     #failure
     if [] in formula:
+        if stats is not None:
+            stats['conflicts']=stats.get('conflicts',0)+1
         return None
     
     #assume first literal
+    if stats is not None:
+        stats['decisions']=stats.get('decisions',0)+1
     this_condition=formula[0][0]
     #recursively compute other variables
     this_reduced=reduce_formula(formula,this_condition)
-    result=satisfying_assignment(this_reduced)
+    result=satisfying_assignment(this_reduced,stats)
     if result is not None:
         return result | {this_condition[0]: this_condition[1]} | unit_clauses
 
@@ -73,7 +78,7 @@ def satisfying_assignment(formula):
     this_condition=(formula[0][0][0],not formula[0][0][1])
     #recursively compute other variables
     this_reduced=reduce_formula(formula,this_condition)
-    result=satisfying_assignment(this_reduced)
+    result=satisfying_assignment(this_reduced,stats)
     if result is not None:
         return result | {this_condition[0]: this_condition[1]} | unit_clauses
 
@@ -0,0 +1,37 @@
+# fixtures shared by the tests of nearby_search: the stub server and a working directory with a few categories
+
+import pytest
+
+import nearby_search
+import stub_places
+
+
+CATEGORIES={'restaurant','zoo','store'}
+
+
+@pytest.fixture(scope='session')
+def server():
+    server=stub_places.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def workdir(tmp_path,monkeypatch):
+    """
+    runs the test in a temporary directory, crawling only CATEGORIES
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(nearby_search,'CATEGORIES',CATEGORIES)
+    return tmp_path
+
+
+@pytest.fixture
+def make_client(server):
+    """
+    function returning a PlacesClient of the stub server, with short waits
+    """
+    def make_client(**kwargs):
+        kwargs={'backoff': 0.01,'token_delay': stub_places.TOKEN_DELAY+0.01}|kwargs
+        return nearby_search.PlacesClient(api_key='test',url=server.url,**kwargs)
+    return make_client
@@ -0,0 +1,119 @@
+# a local stand-in for the Places nearby search API, for the tests of nearby_search:
+# random POIs around CENTER, pages of 20 results, at most 60 per query,
+# and page tokens that only become valid after TOKEN_DELAY seconds
+
+import csv
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+CENTER=(42.365,-71.102)
+TYPES=['restaurant','cafe','bank','zoo']
+TOKEN_DELAY=0.02
+
+
+def make_pois(count=3000,seed=1):
+    """
+    POIs in the API's result format, scattered around CENTER (denser in the middle), each with one of TYPES and maybe 'store'
+    """
+    rng=random.Random(seed)
+    pois=[]
+    for i in range(count):
+        lat=CENTER[0]+rng.gauss(0,0.006)
+        lng=CENTER[1]+rng.gauss(0,0.008)
+        types=[rng.choice(TYPES)]+(['store'] if rng.random()<0.3 else [])+['point_of_interest']
+        pois.append({'place_id': f'P{i}','name': f'poi {i}','geometry': {'location': {'lat': lat,'lng': lng}},'types': types})
+    return pois
+
+
+POIS=make_pois()
+
+
+def haversine(lat1,long1,lat2,long2):
+    p=math.pi/180
+    h=math.sin((lat2-lat1)*p/2)**2+math.cos(lat1*p)*math.cos(lat2*p)*math.sin((long2-long1)*p/2)**2
+    return 2*6371008.8*math.asin(min(1,math.sqrt(h)))
+
+
+def inside(lat,long,radius,categories):
+    """
+    place ids of the POIs within radius of (lat,long) that have one of categories
+    """
+    return {poi['place_id'] for poi in POIS if set(categories)&set(poi['types'])
+            and haversine(lat,long,poi['geometry']['location']['lat'],poi['geometry']['location']['lng'])<=radius}
+
+
+def read_rows(filename):
+    """
+    the rows of a csv file written by nearby_search, without the header
+    """
+    with open(filename,newline='') as file:
+        return list(csv.reader(file))[1:]
+
+
+def found_inside(filename,lat,long,radius):
+    """
+    place ids of a csv file that are inside the search circle (the cells reach a little outside it)
+    """
+    return {row[0] for row in read_rows(filename) if haversine(lat,long,float(row[2]),float(row[3]))<=radius}
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads=True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1',0),Handler)
+        self.tokens={}
+        self.requests=0
+        self.lock=threading.Lock()
+        self.url=f'http://127.0.0.1:{self.server_address[1]}/json'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self,*args):
+        pass
+
+    def do_GET(self):
+        query={key: value[0] for key,value in parse_qs(urlparse(self.path).query).items()}
+        with self.server.lock:
+            self.server.requests+=1
+        if 'pagetoken' in query:
+            token=self.server.tokens.get(query['pagetoken'])
+            if token is None or time.time()<token[0]:
+                return self.reply({'status': 'INVALID_REQUEST','results': []})
+            results,page=token[1],token[2]
+        else:
+            lat,lng=map(float,query['location'].split(','))
+            radius=float(query['radius'])
+            results=[poi for poi in POIS if query['type'] in poi['types']
+                     and haversine(lat,lng,poi['geometry']['location']['lat'],poi['geometry']['location']['lng'])<=radius][:60]
+            page=0
+        response={'status': 'OK' if results else 'ZERO_RESULTS','results': results[20*page:20*page+20]}
+        if 20*page+20<len(results):
+            token=uuid.uuid4().hex
+            self.server.tokens[token]=(time.time()+TOKEN_DELAY,results,page+1)
+            response['next_page_token']=token
+        self.reply(response)
+
+    def reply(self,response):
+        body=json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start():
+    """
+    starts a server on a free port in a background thread, its url is server.url
+    """
+    server=Server()
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
@@ -0,0 +1,47 @@
+# tests of batch_search over several sites
+
+import math
+import os
+
+import nearby_search
+import stub_places
+from conftest import CATEGORIES
+
+
+LAT,LONG=stub_places.CENTER
+
+
+def test_batch_search_splits_sites(workdir,make_client):
+    sites=[('a',LAT,LONG,600),('b',LAT+0.005,LONG,400)]
+    nearby_search.batch_search('batch',sites,client=make_client(),qps=500)
+    assert not os.path.exists('batch.checkpoint.json')
+    for place,lat,long,radius in sites:
+        assert stub_places.found_inside(f'{place}_{radius}.csv',lat,long,radius)==stub_places.inside(lat,long,radius,CATEGORIES)
+
+
+def test_batch_search_restores_the_budget(workdir,make_client):
+    client=make_client()
+    report=nearby_search.batch_search('batch',[('a',LAT,LONG,600),('b',LAT+0.005,LONG,400)],client=client,qps=500,budget=10,
+                                      checkpoint=False)
+    assert report['budget_exhausted'] and report['requests']==10
+    assert client.budget is None
+
+
+def test_dry_run_estimates_without_requests(workdir,make_client):
+    client=make_client()
+    estimate=nearby_search.batch_search('batch',[('a',LAT,LONG,600),('b',LAT+0.005,LONG,400)],client=client,dry_run=True)
+    assert estimate['estimated_requests']>=estimate['cells']*len(CATEGORIES)
+    assert client.counters['requests']==0
+
+
+def test_grid_covers_sites_far_from_the_origin():
+    sites=[(42.365,-71.102,1138),(45.365,-71.102,1138),(48.4,-65.3,800)]
+    tiling=nearby_search.GridTiling(sites)
+    for level in (0,3,5):
+        cells=tiling.squares(level)
+        for lat,long,radius in sites:
+            for i in range(720):
+                angle=i*2*math.pi/720
+                delta_lat,delta_long=nearby_search.meters_to_degrees(lat,0.999*radius*math.sin(angle),0.999*radius*math.cos(angle))
+                point=(lat+delta_lat,long+delta_long)
+                assert any(nearby_search.distance(cell.lat,cell.long,*point)<=cell.radius for cell in cells),(level,lat,long,i)
@@ -0,0 +1,58 @@
+# tests of the response cache of PlacesClient
+
+import nearby_search
+import stub_places
+
+
+LAT,LONG=stub_places.CENTER
+RADIUS=600
+
+
+def test_rerun_is_answered_from_the_cache(workdir,make_client,server):
+    cache=nearby_search.ResponseCache(str(workdir/'cache.sqlite'))
+    nearby_search.nearby_search('first',LAT,LONG,RADIUS,client=make_client(cache=cache),checkpoint=False)
+    requests=server.requests
+    client=make_client(cache=cache)
+    nearby_search.nearby_search('again',LAT,LONG,RADIUS,client=client,checkpoint=False)
+    assert server.requests==requests and client.counters['requests']==0
+    assert stub_places.read_rows('first_600.csv')==stub_places.read_rows('again_600.csv')
+    cache.close()
+
+
+def test_overlapping_crawls_share_the_cache(workdir,make_client):
+    cache=nearby_search.ResponseCache(str(workdir/'cache.sqlite'))
+    nearby_search.nearby_search('first',LAT,LONG,RADIUS,concurrency=8,qps=500,client=make_client(cache=cache),tiling='grid',
+                                checkpoint=False)
+    cache.hits=cache.misses=0
+    nearby_search.nearby_search('shifted',LAT+0.0001,LONG+0.0001,RADIUS,concurrency=8,qps=500,client=make_client(cache=cache),
+                                tiling='grid',checkpoint=False)
+    assert cache.hits>3*cache.misses
+    cache.close()
+
+
+def test_hits_are_written_in_batches(workdir,make_client):
+    cache=nearby_search.ResponseCache(str(workdir/'cache.sqlite'),used_batch=50)
+    nearby_search.nearby_search('first',LAT,LONG,RADIUS,client=make_client(cache=cache),checkpoint=False)
+    commits=[]
+
+    class Connection:
+        def __init__(self,db):
+            self.db=db
+
+        def commit(self):
+            commits.append(1)
+            self.db.commit()
+
+        def __getattr__(self,name):
+            return getattr(self.db,name)
+
+    cache.db=Connection(cache.db)
+    client=make_client(cache=cache)
+    nearby_search.nearby_search('again',LAT,LONG,RADIUS,client=client,checkpoint=False)
+    assert client.counters['requests']==0
+    assert cache.hits>50 and len(commits)==cache.hits//50
+    cache.close()
+    #the rerun hit every response, and the last use of each is on disk after closing
+    cache=nearby_search.ResponseCache(str(workdir/'cache.sqlite'))
+    assert cache.db.execute('SELECT COUNT(*) FROM responses WHERE used<=created').fetchone()[0]==0
+    cache.close()
@@ -0,0 +1,71 @@
+# tests of the crawl frontier and its checkpoint
+
+import os
+
+import pytest
+
+import nearby_search
+import stub_places
+from conftest import CATEGORIES
+
+
+LAT,LONG=stub_places.CENTER
+RADIUS=600
+
+
+@pytest.mark.parametrize('concurrency',[None,8])
+def test_resume_from_checkpoint(workdir,make_client,concurrency):
+    checkpoint=f'site_{RADIUS}.checkpoint.json'
+    for runs in range(1,50):
+        client=make_client(budget=25)
+        nearby_search.nearby_search('site',LAT,LONG,RADIUS,concurrency=concurrency,qps=500,client=client)
+        if not os.path.exists(checkpoint):
+            break
+        assert client.counters['requests']==25
+    assert runs>2
+    rows=stub_places.read_rows(f'site_{RADIUS}.csv')
+    assert len({row[0] for row in rows})==len(rows)
+    assert stub_places.found_inside(f'site_{RADIUS}.csv',LAT,LONG,RADIUS)==stub_places.inside(LAT,LONG,RADIUS,CATEGORIES)
+
+
+@pytest.mark.parametrize('calls',[5,17,40])
+def test_resume_after_interrupt(workdir,server,make_client,calls):
+    class Client(nearby_search.PlacesClient):
+        def get(self,*args,**kwargs):
+            self.calls=getattr(self,'calls',0)+1
+            if self.calls==calls:
+                raise KeyboardInterrupt
+            return super().get(*args,**kwargs)
+
+    client=Client(api_key='test',url=server.url,backoff=0.01,token_delay=stub_places.TOKEN_DELAY+0.01)
+    with pytest.raises(KeyboardInterrupt):
+        nearby_search.nearby_search('site',LAT,LONG,RADIUS,client=client)
+    nearby_search.nearby_search('site',LAT,LONG,RADIUS,client=make_client())
+    assert not os.path.exists(f'site_{RADIUS}.checkpoint.json')
+    assert stub_places.found_inside(f'site_{RADIUS}.csv',LAT,LONG,RADIUS)==stub_places.inside(LAT,LONG,RADIUS,CATEGORIES)
+
+
+def test_checkpoint_of_another_crawl_is_refused(workdir,make_client):
+    nearby_search.nearby_search('site',LAT,LONG,RADIUS,client=make_client(budget=10))
+    with pytest.raises(ValueError):
+        nearby_search.nearby_search('site',LAT+0.001,LONG,RADIUS,client=make_client())
+    with pytest.raises(ValueError):
+        nearby_search.nearby_search('site',LAT,LONG,RADIUS,client=make_client(),columnar='packed')
+
+
+def test_expired_page_token_restarts_once(workdir,server):
+    class Client(nearby_search.PlacesClient):
+        def get(self,lat,long,radius,category,page_token=None,wait=0):
+            if page_token is not None:
+                self.count('requests')
+                return {'status': 'INVALID_REQUEST','results': []}
+            return super().get(lat,long,radius,category,page_token,wait)
+
+    client=Client(api_key='test',url=server.url)
+    crawl=nearby_search.Crawl(client,nearby_search.GridTiling([(LAT,LONG,RADIUS)]))
+    crawl.start(LAT,LONG,RADIUS,['restaurant'])
+    crawl.run()
+    #first page, expired token, first page again, expired token again
+    assert client.counters['requests']==4
+    assert len(crawl.failed)==1
+    assert crawl.category_counts['restaurant']==crawl.density.results==20
@@ -0,0 +1,51 @@
+# tests of the crawl against the local stub of the Places API, sync and async
+# run from the repository root with python -m pytest
+
+import asyncio
+import time
+
+import pytest
+
+import nearby_search
+import stub_places
+from conftest import CATEGORIES
+
+
+LAT,LONG=stub_places.CENTER
+RADIUS=600
+
+
+@pytest.mark.parametrize('tiling',['grid','quad'])
+@pytest.mark.parametrize('concurrency',[None,8])
+def test_crawl_finds_every_poi(workdir,make_client,tiling,concurrency):
+    nearby_search.nearby_search('site',LAT,LONG,RADIUS,concurrency=concurrency,qps=500,client=make_client(),tiling=tiling,
+                                checkpoint=False)
+    rows=stub_places.read_rows(f'site_{RADIUS}.csv')
+    assert len({row[0] for row in rows})==len(rows)
+    assert stub_places.found_inside(f'site_{RADIUS}.csv',LAT,LONG,RADIUS)==stub_places.inside(LAT,LONG,RADIUS,CATEGORIES)
+
+
+def test_sync_and_async_write_the_same_csv(workdir,make_client):
+    def crawl(filename,concurrency):
+        #without skipping cells the density map knows are saturated, both query exactly the same cells
+        crawl=nearby_search.Crawl(make_client(),nearby_search.GridTiling([(LAT,LONG,RADIUS)]),
+                                  nearby_search.DensityMap(limit=float('inf')),output=nearby_search.PoiWriter(filename))
+        crawl.start(LAT,LONG,RADIUS,sorted(CATEGORIES))
+        if concurrency:
+            asyncio.run(crawl.run_async(concurrency,qps=500))
+        else:
+            crawl.run()
+        crawl.output.close()
+        return sorted(stub_places.read_rows(filename))
+
+    assert crawl('sync.csv',None)==crawl('async.csv',8)
+
+
+def test_rate_limit(workdir,make_client):
+    client=make_client()
+    crawl=nearby_search.Crawl(client,nearby_search.QuadTiling())
+    crawl.start(LAT,LONG,RADIUS,['zoo','bank'])
+    start=time.monotonic()
+    asyncio.run(crawl.run_async(8,qps=20))
+    #a burst of at most qps requests, then qps per second
+    assert time.monotonic()-start>=(client.counters['requests']-20)/20*0.95
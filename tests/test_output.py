@@ -0,0 +1,60 @@
+# tests of the POI output: deduplicated csv and columnar copies
+
+import pytest
+
+import nearby_search
+import poi_index
+import stub_places
+from conftest import CATEGORIES
+
+
+LAT,LONG=stub_places.CENTER
+RADIUS=600
+
+
+def test_results_without_id_or_location_are_skipped(workdir,server):
+    class Client(nearby_search.PlacesClient):
+        def get(self,*args,**kwargs):
+            request=super().get(*args,**kwargs)
+            for result in request.get('results',[]):
+                if result.get('place_id')=='P5':
+                    del result['geometry']
+                if result.get('place_id')=='P6':
+                    del result['place_id']
+            return request
+
+    client=Client(api_key='test',url=server.url,backoff=0.01,token_delay=stub_places.TOKEN_DELAY+0.01)
+    nearby_search.nearby_search('site',LAT,LONG,RADIUS,client=client,checkpoint=False)
+    found=stub_places.found_inside(f'site_{RADIUS}.csv',LAT,LONG,RADIUS)
+    assert found==stub_places.inside(LAT,LONG,RADIUS,CATEGORIES)-{'P5','P6'}
+
+
+@pytest.mark.parametrize('index_path,bloom',[(None,0),('places.sqlite',0),(None,1000),('places.sqlite',1000)])
+def test_writer_skips_duplicates(workdir,index_path,bloom):
+    writer=nearby_search.PoiWriter('pois.csv',index=nearby_search.PlaceIndex(index_path,bloom))
+    for i in list(range(300))+list(range(0,300,2)):
+        writer.add((f'P{i}',f'poi {i}',float(i),0.0,('cafe',)))
+    writer.close()
+    assert [row[0] for row in stub_places.read_rows('pois.csv')]==[f'P{i}' for i in range(300)]
+
+
+def test_packed_output_round_trip(workdir,make_client):
+    nearby_search.nearby_search('site',LAT,LONG,RADIUS,concurrency=8,qps=500,client=make_client(),checkpoint=False,columnar='packed')
+    pois=poi_index.load_pois(f'site_{RADIUS}.csv')
+    assert list(nearby_search.read_packed(f'site_{RADIUS}.poi'))==pois
+
+
+def test_pack_batch_round_trip(workdir):
+    pois=[('a','café ☕',1.5,-2.25,('cafe','store')),('b','',0.0,0.0,()),('c','x,y',-89.9,179.9,('zoo',))]
+    with open('pois.poi','wb') as file:
+        file.write(nearby_search.PACKED_HEADER)
+        file.write(nearby_search.pack_batch(pois[:2]))
+        file.write(nearby_search.pack_batch(pois[2:]))
+    assert list(nearby_search.read_packed('pois.poi'))==pois
+
+
+def test_parquet_output(workdir,make_client):
+    parquet=pytest.importorskip('pyarrow.parquet')
+    nearby_search.nearby_search('site',LAT,LONG,RADIUS,concurrency=8,qps=500,client=make_client(),checkpoint=False,columnar='parquet')
+    table=parquet.read_table(f'site_{RADIUS}.parquet')
+    assert sorted(table.column('id').to_pylist())==sorted(poi[0] for poi in poi_index.load_pois(f'site_{RADIUS}.csv'))
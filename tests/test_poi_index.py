@@ -0,0 +1,86 @@
+# tests of poi_index against brute force over random POIs
+
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from poi_index import PoiIndex, build_index, cell_size, haversine
+
+
+TYPES=['restaurant','cafe','bank','zoo']
+
+
+@pytest.fixture(scope='module')
+def pois():
+    rng=random.Random(2)
+    pois=[]
+    for i in range(4000):
+        #a dense center in a sparser area
+        spread=rng.choice([0.002,0.02])
+        lat=42.36+rng.gauss(0,spread)
+        lng=-71.1+rng.gauss(0,1.5*spread)
+        types=tuple(rng.sample(TYPES,rng.randint(0,2)))
+        pois.append((f'P{i}',f'poi {i}',lat,lng,types))
+    return pois
+
+
+@pytest.fixture(scope='module',params=[0.005,None])
+def index(pois,tmp_path_factory,request):
+    filename=str(tmp_path_factory.mktemp('index')/'pois.idx')
+    build_index(pois,filename,cell=request.param,coverage=[(42.36,-71.1,3000)])
+    index=PoiIndex(filename)
+    yield index
+    index.close()
+
+
+def queries():
+    rng=random.Random(3)
+    return [(42.36+rng.gauss(0,0.03),-71.1+rng.gauss(0,0.04)) for _ in range(50)]
+
+
+def brute_force(pois,lat,lng,poi_type=None):
+    return sorted((haversine(lat,lng,poi[2],poi[3]),poi) for poi in pois if poi_type is None or poi_type in poi[4])
+
+
+@pytest.mark.parametrize('poi_type',[None,'zoo','unknown'])
+@pytest.mark.parametrize('radius',[50,400,3000])
+def test_radius(index,pois,poi_type,radius):
+    for lat,lng in queries():
+        expected=[(distance,poi) for distance,poi in brute_force(pois,lat,lng,poi_type) if distance<=radius]
+        assert index.radius(lat,lng,radius,poi_type)==expected
+
+
+@pytest.mark.parametrize('poi_type',[None,'cafe'])
+@pytest.mark.parametrize('k',[1,5,40])
+def test_nearest(index,pois,poi_type,k):
+    for lat,lng in queries():
+        expected=brute_force(pois,lat,lng,poi_type)[:k]
+        found=index.nearest(lat,lng,k,poi_type)
+        #ties aside, the same points at the same distances
+        assert [distance for distance,poi in found]==[distance for distance,poi in expected]
+        assert {poi[0] for distance,poi in found}=={poi[0] for distance,poi in expected}
+
+
+def test_nearest_max_radius(index,pois):
+    for lat,lng in queries():
+        expected=[(distance,poi) for distance,poi in brute_force(pois,lat,lng)[:10] if distance<=200]
+        assert index.nearest(lat,lng,10,max_radius=200)==expected
+
+
+def test_poi_and_covers(index,pois):
+    found=index.radius(pois[0][2],pois[0][3],0.001)
+    assert (0.0,pois[0]) in found
+    assert index.nearest(0,0,3,'unknown')==[]
+    assert index.covers(42.36,-71.1,2000)
+    assert not index.covers(42.36,-71.1,4000)
+    assert not index.covers(43,-71.1)
+
+
+def test_cell_size_follows_density(pois):
+    cell=cell_size(pois,per_cell=32)
+    counts=Counter((math.floor(poi[2]/cell),math.floor(poi[3]/cell)) for poi in pois)
+    #about per_cell points in the cell of an average point, not the thousands of a fixed size in the dense center
+    assert 4<=sum(count*count for count in counts.values())/len(pois)<=32
+    assert cell<0.005
@@ -0,0 +1,80 @@
+# tests of the instance generators and runner of sat_benchmark
+
+import json
+
+import pytest
+
+import sat_benchmark
+from sat_solver import satisfying_assignment
+
+
+@pytest.mark.parametrize('n',[4,9,16])
+def test_sudoku_solution_is_valid(n):
+    board=sat_benchmark.sudoku_solution(n,sat_benchmark.random.Random(n))
+    values=set(range(1,n+1))
+    sub_n=int(n**0.5)
+    assert all(set(row)==values for row in board)
+    assert all({board[row][col] for row in range(n)}==values for col in range(n))
+    assert all({board[band*sub_n+row][stack*sub_n+col] for row in range(sub_n) for col in range(sub_n)}==values
+               for band in range(sub_n) for stack in range(sub_n))
+
+
+def test_sudoku_puzzle_is_reproducible():
+    board=sat_benchmark.sudoku_puzzle(9,0.25,0)
+    assert board==sat_benchmark.sudoku_puzzle(9,0.25,0)
+    assert board!=sat_benchmark.sudoku_puzzle(9,0.25,1)
+    assert sum(value!=0 for row in board for value in row)==round(0.25*81)
+
+
+def test_instance_names_include_the_seed():
+    instances=sat_benchmark.generate_instances((4,),(10,),(3,),seed=7)
+    assert all(instance['name'].endswith('-s7') for instance in instances if instance['family']=='sudoku')
+    #random 3-SAT instance i of a run uses seed+i, the same formula as in a run with that seed
+    assert [instance['name'][-3:] for instance in instances if instance['family']=='3sat']==['-s7','-s8','-s9']
+
+
+def test_read_dimacs(tmp_path):
+    path=tmp_path/'small.cnf'
+    path.write_text('c a comment\np cnf 3 3\n1 -2 0\n2 3\n-1 0\n-3 0\n')
+    assert sat_benchmark.read_dimacs(path)==[[(1,True),(2,False)],[(2,True),(3,True),(1,False)],[(3,False)]]
+
+
+def test_check_model():
+    formula=[[(1,True),(2,False)],[(2,True)]]
+    assert sat_benchmark.check_model(formula,{1: True,2: True})
+    assert not sat_benchmark.check_model(formula,{1: False,2: True})
+    #a variable left out satisfies nothing
+    assert not sat_benchmark.check_model(formula,{2: True})
+
+
+@pytest.mark.parametrize('can_fork',[True,False])
+def test_run_instance_on_unsatisfiable_pigeonhole(monkeypatch,can_fork):
+    monkeypatch.setattr(sat_benchmark,'CAN_FORK',can_fork and sat_benchmark.CAN_FORK)
+    instance={'name': 'pigeonhole-4-3','family': 'pigeonhole','formula': sat_benchmark.pigeonhole(3),'expected': False}
+    result=sat_benchmark.run_instance(satisfying_assignment,instance)
+    assert result['status']=='ok' and result['satisfiable'] is False and result['correct'] is True
+    assert result['decisions']>0 and result['conflicts']>0
+
+
+def test_run_instance_wrong_answer():
+    instance={'name': 'sat','family': '3sat','formula': [[(1,True)]],'expected': True}
+    result=sat_benchmark.run_instance(lambda formula,stats: None,instance)
+    assert result['status']=='wrong' and result['correct'] is False
+
+
+@pytest.mark.skipif(not sat_benchmark.CAN_FORK,reason='timeouts need fork')
+def test_run_instance_timeout():
+    instance={'name': 'pigeonhole-10-9','family': 'pigeonhole','formula': sat_benchmark.pigeonhole(9),'expected': False}
+    result=sat_benchmark.run_instance(satisfying_assignment,instance,timeout=0.2)
+    assert result['status']=='timeout' and result['time'] is None
+
+
+def test_compare_warns_about_another_seed(tmp_path,capsys):
+    output=tmp_path/'bench.json'
+    assert sat_benchmark.main(['--sudoku-sizes','4','--sat-sizes','10','--pigeonholes','3','--output',str(output)])==0
+    with open(output) as file:
+        baseline=json.load(file)
+    sat_benchmark.compare(baseline['results'],baseline,seed=0)
+    assert 'warning' not in capsys.readouterr().out
+    sat_benchmark.compare(baseline['results'],baseline,seed=1)
+    assert 'warning' in capsys.readouterr().out
@@ -0,0 +1,48 @@
+# tests of the tilings and the density map
+
+import math
+import random
+
+import nearby_search
+import stub_places
+from conftest import CATEGORIES
+
+
+def test_density_known_counts_buckets_inside_the_cell():
+    rng=random.Random(3)
+    density=nearby_search.DensityMap()
+    density.found('store',[{'place_id': f'P{i}','types': ['store'],
+                            'geometry': {'location': {'lat': 42.365+rng.gauss(0,0.01),'lng': -71.102+rng.gauss(0,0.012)}}}
+                           for i in range(5000)])
+    for radius in (10,50,200,1000,5000):
+        cell=nearby_search.Cell(42.365+rng.gauss(0,0.01),-71.102+rng.gauss(0,0.012),radius,())
+        expected=0
+        for (row,column),count in density.buckets['store'].items():
+            corners=[(row+i)*density.bucket for i in (0,1)],[(column+j)*density.bucket for j in (0,1)]
+            if all(nearby_search.distance(cell.lat,cell.long,lat,long)<=radius for lat in corners[0] for long in corners[1]):
+                expected+=count
+        assert density.known(cell,'store')==expected
+
+
+def test_quad_children_cover_the_parent():
+    tiling=nearby_search.QuadTiling()
+    root=tiling.root(42.365,-71.102,1000)
+    children=tiling.children(root)
+    rng=random.Random(4)
+    for _ in range(2000):
+        angle,distance=rng.uniform(0,2*math.pi),1000*math.sqrt(rng.random())
+        delta_lat,delta_long=nearby_search.meters_to_degrees(root.lat,distance*math.sin(angle),distance*math.cos(angle))
+        lat,long=root.lat+delta_lat,root.long+delta_long
+        assert any(nearby_search.distance(child.lat,child.long,lat,long)<=child.radius for child in children)
+
+
+def test_request_count(workdir,make_client):
+    #on the stub the quad tiling takes about 140 requests and the grid about 170, a finer or coarser first split shows here
+    requests={}
+    for tiling in ('quad','grid'):
+        client=make_client()
+        nearby_search.nearby_search(tiling,*stub_places.CENTER,600,client=client,tiling=tiling,checkpoint=False)
+        assert stub_places.found_inside(f'{tiling}_600.csv',*stub_places.CENTER,600)==stub_places.inside(*stub_places.CENTER,600,CATEGORIES)
+        requests[tiling]=client.counters['requests']-client.counters['retries']
+    assert requests['quad']<=150
+    assert requests['grid']<=1.25*requests['quad']